@@ -0,0 +1,202 @@
+import numpy as np
+import roi
+
+# Annual rate used to discount monthly cash flows
+DISCOUNT_RATE = 0.10
+
+# Yearly maintenance cost as a share of the labor cost, paid monthly during the maintenance period
+MAINTENANCE_RATE = 0.15
+
+# Benefits start after delivery and ramp up linearly to their full monthly level over this many months
+RAMP_UP_MONTHS = 3
+
+# Benefits are spread over the maintenance period, but never fewer months than this
+MIN_BENEFIT_MONTHS = 12
+
+# Longest project duration and maintenance period the input forms accept
+MAX_PROJECT_DURATION_MONTHS = 120
+MAX_MAINTENANCE_MONTHS = 240
+
+# Monthly rate bracket and iteration limits of the IRR solver
+IRR_BRACKET = (-0.5, 1.0)
+IRR_MAX_ITERATIONS = 100
+IRR_TOLERANCE = 1e-10
+
+def monthly_cash_flows(columns, roles=roi.ROLES, rates=None, formulas=None):
+    """
+    Build monthly cash flows for many projects at once.
+    Month 0 holds the upfront infrastructure, software and training costs, labor is spread
+    evenly over the project duration, and maintenance and ramped-up benefits follow delivery.
+    The undiscounted benefits and costs before maintenance add up to the total benefits and
+    total costs of roi.calculate_roi_batch.
+    Returns an (N, months) matrix padded with zeros after each project's last month.
+    """
+    totals = roi.calculate_roi_batch(columns, roles, rates, formulas)
+    duration = np.ceil(np.asarray(columns['project_duration'], dtype=float))
+    maintenance = np.ceil(np.maximum(np.asarray(columns['maintenance_period'], dtype=float), 0))
+    valid = duration > 0
+    duration = np.where(valid, duration, 1)
+    benefit_months = np.maximum(maintenance, MIN_BENEFIT_MONTHS)
+    
+    horizon = int((duration + benefit_months).max()) if duration.size else 0
+    t = np.arange(horizon + 1)[None, :]
+    duration = duration[:, None]
+    since_delivery = t - duration
+    
+    upfront = totals['infrastructure_cost'] + totals['software_cost'] + totals['training_cost']
+    # Costs a project type's cost formula adds on top of these components are paid upfront too
+    components = totals['labor_cost'] + totals['infrastructure_cost'] + totals['software_cost'] + totals['training_cost']
+    upfront = upfront + (totals['total_costs'] - components)
+    flows = np.where(t == 0, -upfront[:, None], 0.0)
+    flows -= np.where((t >= 1) & (t <= duration), (totals['labor_cost'][:, None] / duration), 0.0)
+    flows -= np.where((since_delivery >= 1) & (since_delivery <= maintenance[:, None]),
+                      totals['labor_cost'][:, None] * MAINTENANCE_RATE / 12, 0.0)
+    
+    ramp = np.where((since_delivery >= 1) & (since_delivery <= benefit_months[:, None]),
+                    np.minimum(since_delivery / RAMP_UP_MONTHS, 1.0), 0.0)
+    flows += totals['total_benefits'][:, None] * ramp / ramp.sum(axis=1, keepdims=True)
+    
+    return np.where(valid[:, None], flows, 0.0)
+
+def _monthly_rate(annual_rate):
+    return (1 + annual_rate) ** (1 / 12) - 1
+
+def npv(flows, discount_rate=DISCOUNT_RATE):
+    """Net present value of each row of monthly cash flows at an annual discount rate"""
+    months = np.arange(flows.shape[1])
+    return flows @ (1 + _monthly_rate(discount_rate)) ** -months
+
+def irr(flows):
+    """
+    Annual internal rate of return of each row of monthly cash flows, solved for all rows
+    at once with a safeguarded Newton method: a Newton step is taken only if it stays inside
+    the bracket around the root and is at most half the step before the last one, so the
+    bracket keeps shrinking; otherwise the bracket is bisected. Rows without a sign change
+    in the bracket, or that do not converge in IRR_MAX_ITERATIONS, get NaN.
+    """
+    months = np.arange(flows.shape[1])
+    n = flows.shape[0]
+    # Last month with a cash flow in each row; the zero padding after it is left out
+    nonzero = flows != 0
+    last_month = np.where(nonzero.any(axis=1), flows.shape[1] - 1 - np.argmax(nonzero[:, ::-1], axis=1), 0)
+    
+    def value_and_slope(rows, rate, last):
+        # For negative rates the value and slope are scaled by (1 + rate) ** last so no
+        # discount factor exceeds 1. The scale is positive and shared by value and slope,
+        # so neither the sign nor the Newton step changes.
+        shift = np.where(rate < 0, last, 0)
+        with np.errstate(over='ignore', invalid='ignore'):
+            discount = np.where(months <= last[:, None], (1 + rate[:, None]) ** (shift[:, None] - months), 0.0)
+        value = (rows * discount).sum(axis=1)
+        slope = -(rows * months * discount / (1 + rate[:, None])).sum(axis=1)
+        return value, slope
+    
+    low = np.full(n, IRR_BRACKET[0])
+    high = np.full(n, IRR_BRACKET[1])
+    value_low, _ = value_and_slope(flows, low, last_month)
+    value_high, _ = value_and_slope(flows, high, last_month)
+    solvable = np.sign(value_low) * np.sign(value_high) < 0
+    
+    rate = (low + high) / 2
+    # Sizes of the last two steps of each row
+    step = high - low
+    step_before = high - low
+    # Only rows that have not converged yet are evaluated again
+    active = np.flatnonzero(solvable)
+    for _ in range(IRR_MAX_ITERATIONS):
+        if active.size == 0:
+            break
+        current = rate[active]
+        value, slope = value_and_slope(flows[active], current, last_month[active])
+        
+        # Keep the root bracketed: replace the end whose value has the same sign
+        same_as_low = np.sign(value) == np.sign(value_low[active])
+        low[active] = np.where(same_as_low, current, low[active])
+        value_low[active] = np.where(same_as_low, value, value_low[active])
+        high[active] = np.where(same_as_low, high[active], current)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = current - value / slope
+        inside = np.isfinite(newton) & (newton > low[active]) & (newton < high[active])
+        # A Newton step that does not halve the step before the last one converges too slowly
+        fast = 2 * np.abs(newton - current) <= np.abs(step_before[active])
+        next_rate = np.where(inside & fast, newton, (low[active] + high[active]) / 2)
+        
+        step_before[active] = step[active]
+        step[active] = next_rate - current
+        rate[active] = next_rate
+        active = active[np.abs(next_rate - current) >= IRR_TOLERANCE]
+    
+    # Rows still active did not converge
+    solvable[active] = False
+    return np.where(solvable, (1 + rate) ** 12 - 1, np.nan)
+
+def payback_month(flows):
+    """Month from which each row's cumulative cash flow stays non-negative, NaN if it never does"""
+    cumulative = np.cumsum(flows, axis=1)
+    # The month after the last negative cumulative value, as long as that is within the horizon
+    negative = cumulative < 0
+    last_negative = np.where(negative.any(axis=1), flows.shape[1] - 1 - np.argmax(negative[:, ::-1], axis=1), -1)
+    month = last_negative + 1.0
+    return np.where(month < flows.shape[1], month, np.nan)
+
+def _horizon_groups(columns):
+    """
+    Row indices grouped by cash flow horizon rounded up to a power of two, so each
+    project is padded to the horizon of similar projects instead of the longest one
+    """
+    duration = np.nan_to_num(np.ceil(np.asarray(columns['project_duration'], dtype=float)))
+    maintenance = np.nan_to_num(np.ceil(np.asarray(columns['maintenance_period'], dtype=float)))
+    horizon = np.maximum(duration, 1) + np.maximum(maintenance, MIN_BENEFIT_MONTHS)
+    buckets = np.ceil(np.log2(horizon))
+    return [np.flatnonzero(buckets == bucket) for bucket in np.unique(buckets)]
+
+def _select_rows(columns, rates, formulas, rows):
+    """The columns, per-project rates and per-project formulas of some rows of a batch"""
+    columns = {key: np.asarray(values)[rows] for key, values in columns.items()}
+    if rates is not None and np.ndim(rates) == 2:
+        rates = np.asarray(rates)[rows]
+    if formulas is not None and not isinstance(formulas, roi.FormulaSet):
+        formulas = [formulas[row] for row in rows]
+    return columns, rates, formulas
+
+def cash_flow_metrics(columns, roles=roi.ROLES, rates=None, discount_rate=DISCOUNT_RATE, formulas=None,
+                      metrics=('npv', 'irr', 'payback_month')):
+    """
+    NPV, annual IRR and payback month (or only the given metrics) of many projects at once.
+    Takes the same columns, rates and formulas as roi.calculate_roi_batch. Projects are
+    calculated in groups of similar length, so one long project does not widen the cash
+    flow matrix of all others.
+    """
+    calculate = {
+        'npv': lambda flows: npv(flows, discount_rate),
+        'irr': irr,
+        'payback_month': payback_month
+    }
+    results = {metric: np.full(len(columns['project_duration']), np.nan) for metric in metrics}
+    for rows in _horizon_groups(columns):
+        group_columns, group_rates, group_formulas = _select_rows(columns, rates, formulas, rows)
+        flows = monthly_cash_flows(group_columns, roles, group_rates, group_formulas)
+        for metric in metrics:
+            results[metric][rows] = calculate[metric](flows)
+    return results
+
+def project_cash_flow(inputs, discount_rate=DISCOUNT_RATE, rates=None, formulas=None):
+    """
+    Monthly cash flows, NPV, IRR (None if undefined) and payback month of one project.
+    rates and formulas are used as in roi.compute_roi.
+    """
+    columns, roles = roi.columns_from_inputs([inputs])
+    flows = monthly_cash_flows(columns, roles, roi.role_rates(roles, rates), formulas)
+    metrics = {
+        'npv': float(npv(flows, discount_rate)[0]),
+        'irr': float(irr(flows)[0]),
+        'payback_month': float(payback_month(flows)[0])
+    }
+    for key in ('irr', 'payback_month'):
+        if np.isnan(metrics[key]):
+            metrics[key] = None
+    # Drop the zero padding after the last month with a cash flow
+    nonzero = np.flatnonzero(flows[0])
+    metrics['cash_flows'] = flows[0, :nonzero[-1] + 1].tolist() if nonzero.size else []
+    return metrics
@@ -0,0 +1,148 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+from contextlib import closing, nullcontext
+from datetime import date
+from urllib.parse import quote
+from itertools import islice
+import numpy as np
+import cashflow
+import roi
+
+# Rows calculated at a time; memory use depends on this, not on the file size
+CHUNK_SIZE = 10_000
+
+# Input columns named 'role_hours.<role>' hold the hours of one role
+ROLE_HOURS_PREFIX = 'role_hours.'
+
+# Tables --db reads the rate card and formulas from
+DATABASE_TABLES = ('rates', 'formulas')
+
+RESULT_COLUMNS = ('total_benefits', 'total_costs', 'roi', 'labor_cost')
+CASH_FLOW_COLUMNS = ('npv', 'irr', 'payback_month')
+
+def _open(path, mode):
+    """Open a CSV file, or stdin/stdout for '-'"""
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, newline='')
+
+def _column(rows, index, default, name):
+    values = [row[index] if index < len(row) and row[index] != '' else default for row in rows]
+    try:
+        return np.array(values, dtype=float)
+    except ValueError as e:
+        raise ValueError(f"Column {name}: {e}") from None
+
+def batch(infile, outfile, chunk_size=CHUNK_SIZE, cash_flow=False, rate_card=None, registry=None):
+    """
+    Stream project rows from one CSV file object to another, adding ROI results.
+    Input columns named like roi.NUMERIC_INPUT_DEFAULTS keys and 'role_hours.<role>' are
+    used for the calculation; every input column is copied to the output. With a rate
+    card and formula registry, a 'project_type' column selects each row's rates and
+    formulas. Returns the number of rows.
+    """
+    reader = csv.reader(infile)
+    header = next(reader, None)
+    if header is None:
+        return 0
+    
+    input_columns = [(name, i) for i, name in enumerate(header) if name in roi.NUMERIC_INPUT_DEFAULTS]
+    role_columns = [(name[len(ROLE_HOURS_PREFIX):], i) for i, name in enumerate(header)
+                    if name.startswith(ROLE_HOURS_PREFIX)]
+    roles = tuple(role for role, _ in role_columns)
+    type_column = header.index('project_type') if 'project_type' in header else None
+    if rate_card is None:
+        rates = roi.role_rates(roles)
+    elif type_column is None:
+        rates = roi.role_rates(roles, rate_card.rates_for())
+    formulas = registry.for_type() if registry is not None else None
+    
+    result_columns = RESULT_COLUMNS + (CASH_FLOW_COLUMNS if cash_flow else ())
+    writer = csv.writer(outfile)
+    writer.writerow(header + list(result_columns))
+    
+    count = 0
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            break
+        
+        columns = {key: np.full(len(rows), default) for key, default in roi.NUMERIC_INPUT_DEFAULTS.items()}
+        for name, i in input_columns:
+            columns[name] = _column(rows, i, roi.NUMERIC_INPUT_DEFAULTS[name], name)
+        columns['role_hours'] = np.column_stack(
+            [_column(rows, i, 0.0, ROLE_HOURS_PREFIX + role) for role, i in role_columns]
+        ) if role_columns else np.zeros((len(rows), 0))
+        
+        if type_column is not None:
+            project_types = [row[type_column] if type_column < len(row) else None for row in rows]
+            if rate_card is not None:
+                rates = rate_card.rate_matrix(roles, project_types)
+            if registry is not None:
+                formulas = registry.for_types(project_types)
+        results = roi.calculate_roi_batch(columns, roles, rates, formulas)
+        if cash_flow:
+            results.update(cashflow.cash_flow_metrics(columns, roles, rates, formulas=formulas))
+        
+        values = np.column_stack([results[key] for key in result_columns]).tolist()
+        # Undefined results (IRR, payback month) are written as empty cells
+        writer.writerows(row + ['' if value != value else value for value in row_values]
+                         for row, row_values in zip(rows, values))
+        count += len(rows)
+    return count
+
+def load_database(path):
+    """
+    Read the rate card and formula registry of an application database. The file is
+    opened read-only and without the application's connection setup, so it is never
+    modified. Raises ValueError if it is not a database with the rates and formulas tables.
+    """
+    # Only loaded when needed, to keep startup fast
+    import database as db
+    import formulas
+    import rates
+    try:
+        with closing(sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)) as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            missing = [table for table in DATABASE_TABLES if table not in tables]
+            if missing:
+                raise ValueError(f"{path} has no {' or '.join(missing)} table; start the application "
+                                 "once with this database to create it")
+            rate_rows = conn.execute(db.SQL_RATES).fetchall()
+            formula_rows = conn.execute(db.SQL_FORMULAS).fetchall()
+    except sqlite3.Error as e:
+        raise ValueError(f"cannot read database {path}: {e}") from None
+    return rates.RateCard(rate_rows, date.today().isoformat()), formulas.FormulaRegistry(formula_rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='roi-calc', description="ROI calculations without the web application")
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch_parser = commands.add_parser('batch', help="add ROI results to every project row of a CSV file")
+    batch_parser.add_argument('input', help="input CSV file, or - for stdin")
+    batch_parser.add_argument('output', help="output CSV file, or - for stdout")
+    batch_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="rows calculated at a time")
+    batch_parser.add_argument('--cash-flow', action='store_true', help="add NPV, IRR and payback month")
+    batch_parser.add_argument('--db', help="use the rate card and formulas of this database instead of the standard ones")
+    args = parser.parse_args(argv)
+    
+    rate_card = None
+    registry = None
+    if args.db:
+        if not os.path.exists(args.db):
+            parser.error(f"database not found: {args.db}")
+        try:
+            rate_card, registry = load_database(args.db)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    try:
+        with _open(args.input, 'r') as infile, _open(args.output, 'w') as outfile:
+            batch(infile, outfile, args.chunk_size, args.cash_flow, rate_card, registry)
+    except ValueError as e:
+        parser.exit(1, f"roi-calc: error: {e}\n")
+
+if __name__ == "__main__":
+    main()
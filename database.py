@@ -1,320 +1,1261 @@
+import os
 import sqlite3
+import logging
 import hashlib
-from datetime import datetime
+import queue
+import threading
+import time
+import copy
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
 import json
+import instrumentation
+import roi
 
-def init_db():
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
+logger = logging.getLogger(__name__)
+instrumentation.register_internal_file(__file__)
+
+DB_PATH = 'impact_calculator.db'
+
+# Connection pool settings. Streamlit runs every script execution in its own
+# thread, so connections are checked out per thread and returned to the pool
+# afterwards instead of being opened and closed by every function.
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 20000
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Number of projects per page in paginated listings
+PAGE_SIZE = 50
+
+# Stay below SQLite's default limit on host parameters per statement
+MAX_QUERY_PARAMS = 900
+
+# When set, init_db() verifies that no query in this module does an unexpected full table scan
+CHECK_QUERY_PLANS = os.environ.get('ROI_CHECK_QUERY_PLANS') == '1'
+
+# Input stored in the project_role_hours table instead of project_inputs
+ROLE_HOURS_INPUT = 'role_hours'
+
+# Effective date of the rates seeded into an empty rate card
+DEFAULT_RATES_EFFECTIVE_FROM = '1970-01-01'
+
+# Read cache settings shared by every session in the process
+READ_CACHE_MAX_ENTRIES = 1024
+READ_CACHE_TTL_SECONDS = 300
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports the latency and row count of every statement to instrumentation"""
     
-    # Create users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  role TEXT NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    _pending = None
     
-    # Create projects table
-    c.execute('''CREATE TABLE IF NOT EXISTS projects
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  title TEXT NOT NULL,
-                  description TEXT,
-                  project_type TEXT NOT NULL,
-                  status TEXT DEFAULT 'submitted',
-                  customer_id INTEGER,
-                  pm_estimate REAL,
-                  it_director_estimate REAL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (customer_id) REFERENCES users (id))''')
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        if self.description is None:
+            # Statements that return no rows are complete once executed
+            instrumentation.record_query(sql, time.perf_counter() - start, max(self.rowcount, 0))
+        else:
+            # Queries are recorded once their rows have been fetched
+            self._pending = (sql, start)
+        return self
     
-    # Create project inputs table
-    c.execute('''CREATE TABLE IF NOT EXISTS project_inputs
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  project_id INTEGER,
-                  input_type TEXT NOT NULL,
-                  value REAL NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (project_id) REFERENCES projects (id))''')
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        instrumentation.record_query(sql, time.perf_counter() - start, max(self.rowcount, 0))
+        return self
     
-    conn.commit()
-    conn.close()
+    def fetchone(self):
+        row = super().fetchone()
+        self._finish(0 if row is None else 1)
+        return row
+    
+    def fetchall(self):
+        rows = super().fetchall()
+        self._finish(len(rows))
+        return rows
+    
+    def _finish(self, rows=0):
+        if self._pending is not None:
+            sql, start = self._pending
+            self._pending = None
+            instrumentation.record_query(sql, time.perf_counter() - start, rows)
+
+class _InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _open_connection():
+    """Open a new connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(DB_PATH,
+                           timeout=BUSY_TIMEOUT_MS / 1000,
+                           isolation_level=None,
+                           check_same_thread=False,
+                           factory=_InstrumentedConnection)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+@contextmanager
+def connection():
+    """
+    Check out a pooled connection for the current thread.
+    Nested calls in the same thread share the connection that is already checked out.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+    
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection()
+    
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+@contextmanager
+def transaction():
+    """
+    Run the enclosed statements in a single write transaction.
+    A transaction opened inside another one joins the outer transaction.
+    """
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+        
+        conn.execute('BEGIN IMMEDIATE')
+        _local.on_commit = []
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            _local.on_commit = []
+            raise
+        else:
+            conn.commit()
+            callbacks, _local.on_commit = _local.on_commit, []
+            for callback in callbacks:
+                callback()
+
+def _on_commit(callback):
+    """Run callback once the current transaction commits, or right away outside of one"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        _local.on_commit.append(callback)
+    else:
+        callback()
+
+def close_pool():
+    """Close every idle pooled connection"""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+class _ReadCache:
+    """Thread-safe LRU cache with a time-to-live, shared by all sessions"""
+    
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return (found, value) for key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+_read_cache = _ReadCache(READ_CACHE_MAX_ENTRIES, READ_CACHE_TTL_SECONDS)
+
+# Data versions used in the cache keys. Write paths bump them once their
+# transaction commits, so stale entries are simply never looked up again.
+_versions_lock = threading.Lock()
+_listing_version = 0
+_project_versions = {}
+# Bumped by every write, for results derived from all projects at once
+_data_version = 0
+
+def _project_version(project_id):
+    return _project_versions.get(('project', project_id), 0)
+
+def _roi_version(project_id):
+    return _project_versions.get(('roi', project_id), 0)
+
+def _invalidate(project_id=None, listings=False, scope='project'):
+    """
+    Bump the data versions touched by a write.
+    scope is 'project' for the project row and its inputs, or 'roi' for its stored ROI result.
+    """
+    def bump():
+        global _listing_version, _data_version
+        with _versions_lock:
+            _data_version += 1
+            if listings:
+                _listing_version += 1
+            if project_id is not None:
+                key = (scope, project_id)
+                _project_versions[key] = _project_versions.get(key, 0) + 1
+    _on_commit(bump)
+
+def data_version():
+    """Version of all project data; changes with every write made by this process"""
+    return _data_version
+
+def _copy_result(value):
+    """
+    Copy a cached result, since callers modify the dictionaries and lists they get back,
+    including those inside tuples such as the (projects, cursor) pages of list_projects.
+    Rows are tuples of plain values, so the lists holding them are copied shallowly.
+    """
+    if isinstance(value, dict):
+        return copy.deepcopy(value)
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, tuple):
+        return tuple(_copy_result(item) for item in value)
+    return value
+
+def _cached(version_of):
+    """
+    Serve a read function from the shared cache.
+    version_of receives the function arguments and returns the data version the result depends on.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())), version_of(*args, **kwargs))
+            found, value = _read_cache.get(key)
+            if not found:
+                value = func(*args, **kwargs)
+                if value is not None:
+                    _read_cache.put(key, value)
+            return _copy_result(value)
+        return wrapper
+    return decorator
+
+def cache_stats():
+    """Return hit/miss counters and the size of the shared read cache"""
+    return _read_cache.stats()
+
+def clear_cache():
+    _read_cache.clear()
+
+# Queries shared by the functions below and the query plan checker
+SQL_VERIFY_USER = 'SELECT * FROM users WHERE username = ? AND password = ?'
+SQL_USER_PROJECTS = 'SELECT * FROM projects WHERE customer_id = ?'
+SQL_ALL_PROJECTS_RAW = 'SELECT * FROM projects'
+SQL_ALL_USERS = 'SELECT * FROM users'
+SQL_ALL_PROJECT_INPUTS = 'SELECT * FROM project_inputs'
+SQL_ALL_PROJECTS = '''SELECT p.*, u.username as customer_name 
+                      FROM projects p 
+                      LEFT JOIN users u ON p.customer_id = u.id'''
+SQL_PROJECTS_BY_STATUS = '''SELECT p.*, u.username as customer_name 
+                            FROM projects p 
+                            LEFT JOIN users u ON p.customer_id = u.id
+                            WHERE p.status = ?
+                            ORDER BY p.created_at'''
+SQL_PROJECT = '''SELECT p.*, u.username as customer_name
+                 FROM projects p
+                 LEFT JOIN users u ON p.customer_id = u.id
+                 WHERE p.id = ?'''
+SQL_LIST_PROJECTS = '''SELECT p.*, u.username as customer_name
+                       FROM projects p
+                       LEFT JOIN users u ON p.customer_id = u.id
+                       {where}
+                       ORDER BY p.created_at DESC, p.id DESC
+                       LIMIT ?'''
+SQL_COUNT_PROJECTS = 'SELECT COUNT(*) FROM projects p {where}'
+SQL_PROJECT_SUMMARIES = '''SELECT id, title, status, project_type, pm_estimate, it_director_estimate, created_at
+                           FROM projects
+                           WHERE customer_id = ? {after}
+                           ORDER BY created_at DESC, id DESC
+                           LIMIT ?'''
+SQL_TIMELINE_PROJECTS = '''SELECT p.created_at, p.project_type, p.status, p.title, u.username
+                           FROM projects p
+                           LEFT JOIN users u ON p.customer_id = u.id'''
+# Weeks start on Monday: the next Sunday (or the day itself), six days back
+SQL_TIMELINE_WEEKS = '''SELECT date(created_at, 'weekday 0', '-6 days') AS week, project_type, status, COUNT(*)
+                        FROM projects
+                        GROUP BY week, project_type, status
+                        ORDER BY week'''
+SQL_PROJECT_INPUTS = '''SELECT input_type, value_num, value_text, value_json
+                        FROM project_inputs
+                        WHERE project_id = ?'''
+SQL_PROJECT_INPUTS_MANY = '''SELECT project_id, input_type, value_num, value_text, value_json
+                             FROM project_inputs
+                             WHERE project_id IN ({placeholders})'''
+SQL_PROJECT_ROLE_HOURS = '''SELECT role, hours
+                            FROM project_role_hours
+                            WHERE project_id = ?
+                            ORDER BY id'''
+SQL_PROJECT_ROLE_HOURS_MANY = '''SELECT project_id, role, hours
+                                 FROM project_role_hours
+                                 WHERE project_id IN ({placeholders})
+                                 ORDER BY id'''
+SQL_PROJECT_ROI = '''SELECT input_hash, total_benefits, total_costs, roi,
+                            expected_revenue, time_savings, efficiency_improvement,
+                            labor_cost, infrastructure_cost, software_cost, training_cost
+                     FROM project_roi
+                     WHERE project_id = ?'''
+SQL_UPSERT_PROJECT_ROI = '''INSERT OR REPLACE INTO project_roi
+                            (project_id, input_hash, total_benefits, total_costs, roi,
+                             expected_revenue, time_savings, efficiency_improvement,
+                             labor_cost, infrastructure_cost, software_cost, training_cost)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SQL_UPSERT_PROJECT_INPUT = '''INSERT INTO project_inputs (project_id, input_type, value_num, value_text, value_json)
+                              VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (project_id, input_type)
+                              DO UPDATE SET value_num = excluded.value_num,
+                                            value_text = excluded.value_text,
+                                            value_json = excluded.value_json,
+                                            created_at = CURRENT_TIMESTAMP'''
+SQL_UPSERT_ROLE_HOURS = '''INSERT INTO project_role_hours (project_id, role, hours)
+                           VALUES (?, ?, ?)
+                           ON CONFLICT (project_id, role)
+                           DO UPDATE SET hours = excluded.hours'''
+SQL_DELETE_ROLE_HOURS = 'DELETE FROM project_role_hours WHERE project_id = ? AND role = ?'
+SQL_CREATE_PROJECT_INPUTS = '''CREATE TABLE IF NOT EXISTS project_inputs
+                               (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                project_id INTEGER,
+                                input_type TEXT NOT NULL,
+                                value_num REAL,
+                                value_text TEXT,
+                                value_json TEXT,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                FOREIGN KEY (project_id) REFERENCES projects (id))'''
+SQL_PORTFOLIO_PROJECTS = 'SELECT id, title, project_type, status FROM projects ORDER BY id'
+SQL_PORTFOLIO_INPUTS = '''SELECT project_id, input_type, value_num
+                          FROM project_inputs
+                          WHERE input_type IN ({placeholders}) AND value_num IS NOT NULL'''
+SQL_PORTFOLIO_ROLE_HOURS = 'SELECT project_id, role, hours FROM project_role_hours'
+SQL_ENQUEUE_ROI_JOB = '''INSERT INTO roi_jobs (project_id)
+                         VALUES (?)
+                         ON CONFLICT (project_id)
+                         DO UPDATE SET status = 'pending',
+                                       generation = generation + 1,
+                                       error = NULL,
+                                       enqueued_at = CURRENT_TIMESTAMP,
+                                       finished_at = NULL'''
+SQL_ENQUEUE_ALL_ROI_JOBS = '''INSERT INTO roi_jobs (project_id)
+                              SELECT id FROM projects WHERE true
+                              ON CONFLICT (project_id)
+                              DO UPDATE SET status = 'pending',
+                                            generation = generation + 1,
+                                            error = NULL,
+                                            enqueued_at = CURRENT_TIMESTAMP,
+                                            finished_at = NULL'''
+SQL_PENDING_ROI_JOBS = '''SELECT project_id, generation
+                          FROM roi_jobs
+                          WHERE status = 'pending'
+                          ORDER BY enqueued_at
+                          LIMIT ?'''
+SQL_START_ROI_JOB = '''UPDATE roi_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+                       WHERE project_id = ?'''
+SQL_FINISH_ROI_JOB = """UPDATE roi_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                        WHERE project_id = ? AND generation = ? AND status = 'running'"""
+SQL_REQUEUE_STALE_ROI_JOBS = '''UPDATE roi_jobs SET status = 'pending'
+                                WHERE status = 'running' AND started_at < datetime('now', ?)'''
+SQL_ROI_JOB_PROGRESS = 'SELECT status, COUNT(*) FROM roi_jobs GROUP BY status'
+# A single row requests a bulk re-cost of the whole portfolio, coalescing repeated requests
+SQL_REQUEST_RECOST = '''INSERT INTO roi_recost (id)
+                        VALUES (1)
+                        ON CONFLICT (id)
+                        DO UPDATE SET status = 'pending',
+                                      generation = generation + 1,
+                                      error = NULL,
+                                      enqueued_at = CURRENT_TIMESTAMP,
+                                      finished_at = NULL'''
+SQL_PENDING_RECOST = '''SELECT generation
+                        FROM roi_recost
+                        WHERE id = 1
+                          AND (status = 'pending' OR (status = 'running' AND started_at < datetime('now', ?)))'''
+SQL_START_RECOST = '''UPDATE roi_recost SET status = 'running', started_at = CURRENT_TIMESTAMP
+                      WHERE id = 1'''
+SQL_FINISH_RECOST = """UPDATE roi_recost SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                       WHERE id = 1 AND generation = ? AND status = 'running'"""
+SQL_RECOST_STATUS = 'SELECT status, error, enqueued_at, finished_at FROM roi_recost WHERE id = 1'
+SQL_ROI_COMPUTED_BEFORE = 'SELECT 1 FROM project_roi WHERE computed_at < ? LIMIT 1'
+SQL_RATE_EFFECTIVE_FROM = 'SELECT effective_from FROM rates WHERE id = ?'
+SQL_RATES = '''SELECT id, role, project_type, hourly_rate, effective_from
+               FROM rates
+               ORDER BY effective_from, id'''
+# Rates are never updated in place (a replaced rate gets a new id), so any change alters this pair
+SQL_RATES_REVISION = 'SELECT COUNT(*), MAX(id) FROM rates'
+SQL_UPSERT_RATE = '''INSERT OR REPLACE INTO rates (role, project_type, hourly_rate, effective_from)
+                     VALUES (?, ?, ?, ?)'''
+SQL_DELETE_RATE = 'DELETE FROM rates WHERE id = ?'
+SQL_FORMULAS = '''SELECT id, name, project_type, expression
+                  FROM formulas
+                  ORDER BY id'''
+# Like rates, a replaced formula gets a new id
+SQL_FORMULAS_REVISION = 'SELECT COUNT(*), MAX(id) FROM formulas'
+SQL_UPSERT_FORMULA = '''INSERT OR REPLACE INTO formulas (name, project_type, expression)
+                        VALUES (?, ?, ?)'''
+SQL_DELETE_FORMULA = 'DELETE FROM formulas WHERE id = ?'
+
+# Query name -> (sql, sample parameters, table aliases allowed to be fully scanned)
+QUERY_PLAN_CHECKS = {
+    'verify_user': (SQL_VERIFY_USER, ('', ''), ()),
+    'get_user_projects': (SQL_USER_PROJECTS, (0,), ()),
+    'get_all_projects': (SQL_ALL_PROJECTS, (), ('p',)),
+    'check_database_projects': (SQL_ALL_PROJECTS_RAW, (), ('projects',)),
+    'check_database_users': (SQL_ALL_USERS, (), ('users',)),
+    'check_database_inputs': (SQL_ALL_PROJECT_INPUTS, (), ('project_inputs',)),
+    'get_projects_by_status': (SQL_PROJECTS_BY_STATUS, ('',), ()),
+    'get_project': (SQL_PROJECT, (0,), ()),
+    'list_projects': (SQL_LIST_PROJECTS.format(where=''), (1,), ('p',)),
+    'list_projects_after': (SQL_LIST_PROJECTS.format(where='WHERE (p.created_at, p.id) < (?, ?)'), ('', 0, 1), ()),
+    'list_projects_by_status': (SQL_LIST_PROJECTS.format(where='WHERE p.status = ?'), ('', 1), ()),
+    'list_projects_by_type': (SQL_LIST_PROJECTS.format(where='WHERE p.project_type = ?'), ('', 1), ()),
+    'list_projects_by_customer': (SQL_LIST_PROJECTS.format(where='WHERE p.customer_id = ?'), (0, 1), ()),
+    'count_projects': (SQL_COUNT_PROJECTS.format(where=''), (), ('projects',)),
+    'count_projects_by_status': (SQL_COUNT_PROJECTS.format(where='WHERE p.status = ?'), ('',), ()),
+    'list_project_summaries': (SQL_PROJECT_SUMMARIES.format(after=''), (0, 1), ()),
+    'list_project_summaries_after': (SQL_PROJECT_SUMMARIES.format(after='AND (created_at, id) < (?, ?)'), (0, '', 0, 1), ()),
+    'get_project_timeline': (SQL_TIMELINE_PROJECTS, (), ('p',)),
+    'get_project_timeline_weeks': (SQL_TIMELINE_WEEKS, (), ('projects',)),
+    'get_project_inputs': (SQL_PROJECT_INPUTS, (0,), ()),
+    'get_project_roi': (SQL_PROJECT_ROI, (0,), ()),
+    'get_project_inputs_many': (SQL_PROJECT_INPUTS_MANY.format(placeholders='?, ?'), (0, 1), ()),
+    'get_project_role_hours': (SQL_PROJECT_ROLE_HOURS, (0,), ()),
+    'get_project_role_hours_many': (SQL_PROJECT_ROLE_HOURS_MANY.format(placeholders='?, ?'), (0, 1), ()),
+    'delete_role_hours': (SQL_DELETE_ROLE_HOURS, (0, ''), ()),
+    'get_portfolio_projects': (SQL_PORTFOLIO_PROJECTS, (), ('projects',)),
+    'get_portfolio_inputs': (SQL_PORTFOLIO_INPUTS.format(placeholders='?, ?'), ('', ''), ('project_inputs',)),
+    'get_portfolio_role_hours': (SQL_PORTFOLIO_ROLE_HOURS, (), ('project_role_hours',)),
+    'claim_roi_jobs': (SQL_PENDING_ROI_JOBS, (1,), ()),
+    'start_roi_job': (SQL_START_ROI_JOB, (0,), ()),
+    'finish_roi_job': (SQL_FINISH_ROI_JOB, ('', None, 0, 0), ()),
+    'requeue_stale_roi_jobs': (SQL_REQUEUE_STALE_ROI_JOBS, ('-10 minutes',), ()),
+    'get_roi_job_progress': (SQL_ROI_JOB_PROGRESS, (), ('roi_jobs',)),
+    'claim_recost': (SQL_PENDING_RECOST, ('-10 minutes',), ()),
+    'start_recost': (SQL_START_RECOST, (), ()),
+    'finish_recost': (SQL_FINISH_RECOST, ('', None, 0), ()),
+    'get_recost_status': (SQL_RECOST_STATUS, (), ()),
+    'request_recost_if_computed_before': (SQL_ROI_COMPUTED_BEFORE, ('',), ('project_roi',)),
+    'get_rate_effective_from': (SQL_RATE_EFFECTIVE_FROM, (0,), ()),
+    'get_rates': (SQL_RATES, (), ('rates',)),
+    'get_rates_revision': (SQL_RATES_REVISION, (), ('rates',)),
+    'delete_rate': (SQL_DELETE_RATE, (0,), ()),
+    'get_formulas': (SQL_FORMULAS, (), ('formulas',)),
+    'get_formulas_revision': (SQL_FORMULAS_REVISION, (), ('formulas',)),
+    'delete_formula': (SQL_DELETE_FORMULA, (0,), ()),
+}
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Run init_db once per process for the current DB_PATH; later calls return at once"""
+    if DB_PATH in _schema_ready:
+        return
+    with _schema_lock:
+        if DB_PATH not in _schema_ready:
+            init_db()
+            _schema_ready.add(DB_PATH)
+
+def init_db():
+    with transaction() as conn:
+        c = conn.cursor()
+        
+        # Create users table
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      username TEXT UNIQUE NOT NULL,
+                      password TEXT NOT NULL,
+                      role TEXT NOT NULL,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        
+        # Create projects table
+        c.execute('''CREATE TABLE IF NOT EXISTS projects
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      title TEXT NOT NULL,
+                      description TEXT,
+                      project_type TEXT NOT NULL,
+                      status TEXT DEFAULT 'submitted',
+                      customer_id INTEGER,
+                      pm_estimate REAL,
+                      it_director_estimate REAL,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (customer_id) REFERENCES users (id))''')
+        
+        # Create project inputs table
+        c.execute(SQL_CREATE_PROJECT_INPUTS)
+        
+        # Create role hours table
+        c.execute('''CREATE TABLE IF NOT EXISTS project_role_hours
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      project_id INTEGER NOT NULL,
+                      role TEXT NOT NULL,
+                      hours REAL NOT NULL,
+                      UNIQUE (project_id, role),
+                      FOREIGN KEY (project_id) REFERENCES projects (id))''')
+        
+        # Databases created before typed storage keep every input in a single REAL column
+        columns = [row[1] for row in c.execute('PRAGMA table_info(project_inputs)').fetchall()]
+        if 'value' in columns:
+            _migrate_legacy_inputs(c)
+        
+        # Create materialized ROI results table
+        c.execute('''CREATE TABLE IF NOT EXISTS project_roi
+                     (project_id INTEGER PRIMARY KEY,
+                      input_hash TEXT NOT NULL,
+                      total_benefits REAL NOT NULL,
+                      total_costs REAL NOT NULL,
+                      roi REAL NOT NULL,
+                      expected_revenue REAL NOT NULL,
+                      time_savings REAL NOT NULL,
+                      efficiency_improvement REAL NOT NULL,
+                      labor_cost REAL NOT NULL,
+                      infrastructure_cost REAL NOT NULL,
+                      software_cost REAL NOT NULL,
+                      training_cost REAL NOT NULL,
+                      computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (project_id) REFERENCES projects (id))''')
+        
+        # Create ROI recalculation job queue; one row per project coalesces duplicate jobs
+        c.execute('''CREATE TABLE IF NOT EXISTS roi_jobs
+                     (project_id INTEGER PRIMARY KEY,
+                      status TEXT NOT NULL DEFAULT 'pending',
+                      generation INTEGER NOT NULL DEFAULT 1,
+                      error TEXT,
+                      enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      started_at TIMESTAMP,
+                      finished_at TIMESTAMP,
+                      FOREIGN KEY (project_id) REFERENCES projects (id))''')
+        
+        # Create the portfolio re-cost request; rate and formula changes are applied in one batch
+        c.execute('''CREATE TABLE IF NOT EXISTS roi_recost
+                     (id INTEGER PRIMARY KEY CHECK (id = 1),
+                      status TEXT NOT NULL DEFAULT 'pending',
+                      generation INTEGER NOT NULL DEFAULT 1,
+                      error TEXT,
+                      enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      started_at TIMESTAMP,
+                      finished_at TIMESTAMP)''')
+        
+        # Create rate card; an empty project_type applies to every project type
+        c.execute('''CREATE TABLE IF NOT EXISTS rates
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      role TEXT NOT NULL,
+                      project_type TEXT NOT NULL DEFAULT '',
+                      hourly_rate REAL NOT NULL,
+                      effective_from DATE NOT NULL,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      UNIQUE (role, project_type, effective_from))''')
+        if c.execute('SELECT 1 FROM rates LIMIT 1').fetchone() is None:
+            c.executemany(SQL_UPSERT_RATE, [(role, '', rate, DEFAULT_RATES_EFFECTIVE_FROM)
+                                            for role, rate in roi.STANDARD_RATES.items()])
+        
+        # Create formula overrides; formulas not stored here come from roi.FORMULAS
+        c.execute('''CREATE TABLE IF NOT EXISTS formulas
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT NOT NULL,
+                      project_type TEXT NOT NULL DEFAULT '',
+                      expression TEXT NOT NULL,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      UNIQUE (name, project_type))''')
+        
+        # Older databases may hold duplicate inputs; drop them before enforcing uniqueness
+        c.execute("""SELECT 1 FROM sqlite_master
+                     WHERE type = 'index' AND name = 'idx_project_inputs_project_type'""")
+        if c.fetchone() is None:
+            c.execute('''DELETE FROM project_inputs
+                         WHERE id NOT IN (SELECT MAX(id) FROM project_inputs
+                                          GROUP BY project_id, input_type)''')
+        
+        # Create indexes
+        c.execute('DROP INDEX IF EXISTS idx_projects_customer')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_projects_customer_created ON projects (customer_id, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_projects_type_created ON projects (project_type, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_projects_created ON projects (created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_projects_status_created ON projects (status, created_at)')
+        c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_project_inputs_project_type
+                     ON project_inputs (project_id, input_type)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_roi_jobs_status ON roi_jobs (status, enqueued_at)')
+        # users.id is the rowid, so the "LEFT JOIN users u ON p.customer_id = u.id"
+        # lookups are already rowid searches and need no extra index
+    
+    if CHECK_QUERY_PLANS:
+        check_query_plans()
+
+def explain_query(sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    with connection() as conn:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [row[-1] for row in rows]
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN over every query in QUERY_PLAN_CHECKS.
+    Raises RuntimeError listing the queries that fully scan a table they should search.
+    """
+    failures = []
+    for name, (sql, params, allowed_scans) in QUERY_PLAN_CHECKS.items():
+        for detail in explain_query(sql, params):
+            if not detail.startswith('SCAN '):
+                continue
+            table = detail.split()[1]
+            if table not in allowed_scans:
+                failures.append(f"{name}: {detail}")
+    
+    if failures:
+        raise RuntimeError("Full table scans found:\n" + "\n".join(failures))
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def create_user(username, password, role):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
-                 (username, hash_password(password), role))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                         (username, hash_password(password), role))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def verify_user(username, password):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username = ? AND password = ?',
-             (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user
+    with connection() as conn:
+        c = conn.execute(SQL_VERIFY_USER,
+                         (username, hash_password(password)))
+        return c.fetchone()
 
 def create_project(title, description, project_type, customer_id):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        c.execute('''INSERT INTO projects (title, description, project_type, customer_id)
-                     VALUES (?, ?, ?, ?)''', (title, description, project_type, customer_id))
-        project_id = c.lastrowid
-        conn.commit()
-        print(f"Project created successfully with ID: {project_id}")
+        with transaction() as conn:
+            c = conn.execute('''INSERT INTO projects (title, description, project_type, customer_id)
+                                VALUES (?, ?, ?, ?)''', (title, description, project_type, customer_id))
+            project_id = c.lastrowid
+            _invalidate(project_id, listings=True)
+        logger.debug("Project created successfully with ID: %s", project_id)
         return project_id
     except Exception as e:
-        print(f"Error creating project: {e}")
+        logger.error("Error creating project: %s", e)
         return None
-    finally:
-        conn.close()
 
 def get_user_projects(user_id):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM projects WHERE customer_id = ?', (user_id,))
-    projects = c.fetchall()
-    conn.close()
-    return projects
+    with connection() as conn:
+        c = conn.execute(SQL_USER_PROJECTS, (user_id,))
+        return c.fetchall()
 
+@_cached(lambda: _listing_version)
 def get_all_projects():
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        print("\n=== Database Status ===")
-        
-        # Проверим все проекты без JOIN
-        print("\n=== Projects without JOIN ===")
-        c.execute('SELECT * FROM projects')
-        raw_projects = c.fetchall()
-        print(f"Total projects: {len(raw_projects)}")
-        for p in raw_projects:
-            print(f"Project ID: {p[0]}, Title: {p[1]}, Status: {p[4]}")
-        
-        # Проверим пользователей
-        print("\n=== Users ===")
-        c.execute('SELECT * FROM users')
-        users = c.fetchall()
-        print(f"Total users: {len(users)}")
-        for u in users:
-            print(f"User ID: {u[0]}, Username: {u[1]}, Role: {u[3]}")
-        
-        # Получаем проекты с JOIN
-        print("\n=== Projects with JOIN ===")
-        c.execute('''SELECT p.*, u.username as customer_name 
-                     FROM projects p 
-                     LEFT JOIN users u ON p.customer_id = u.id''')
-        projects = c.fetchall()
-        print(f"Retrieved {len(projects)} projects with JOIN")
-        
-        for project in projects:
-            print(f"\nProject details:")
-            print(f"ID: {project[0]}")
-            print(f"Title: {project[1]}")
-            print(f"Status: {project[4]}")
-            print(f"Customer ID: {project[5]}")
-            print(f"Customer Name: {project[9]}")
-            
+        with connection() as conn:
+            projects = conn.execute(SQL_ALL_PROJECTS).fetchall()
+        logger.debug("Retrieved %d projects", len(projects))
         return projects
     except Exception as e:
-        print(f"Error getting projects: {e}")
+        logger.error("Error getting projects: %s", e)
         return []
-    finally:
-        conn.close()
+
+def _project_filters(status=None, project_type=None, customer_id=None):
+    """Build the WHERE conditions and parameters for the project listing filters"""
+    conditions = []
+    params = []
+    if status is not None:
+        conditions.append('p.status = ?')
+        params.append(status)
+    if project_type is not None:
+        conditions.append('p.project_type = ?')
+        params.append(project_type)
+    if customer_id is not None:
+        conditions.append('p.customer_id = ?')
+        params.append(customer_id)
+    return conditions, params
+
+@_cached(lambda *args, **kwargs: _listing_version)
+def list_projects(status=None, project_type=None, customer_id=None, after=None, limit=PAGE_SIZE):
+    """
+    Get one page of projects, newest first, in the same row format as get_all_projects.
+    after is the cursor returned for the previous page. Returns (projects, next_cursor),
+    where next_cursor is None on the last page.
+    """
+    conditions, params = _project_filters(status, project_type, customer_id)
+    if after is not None:
+        # Keyset pagination on (created_at, id)
+        conditions.append('(p.created_at, p.id) < (?, ?)')
+        params.extend(after)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
+    try:
+        with connection() as conn:
+            # Fetch one extra row to know whether there is a next page
+            projects = conn.execute(SQL_LIST_PROJECTS.format(where=where), params + [limit + 1]).fetchall()
+    except Exception as e:
+        logger.error("Error listing projects: %s", e)
+        return [], None
+    
+    if len(projects) <= limit:
+        return projects, None
+    projects = projects[:limit]
+    return projects, (projects[-1][8], projects[-1][0])
+
+@_cached(lambda *args, **kwargs: _listing_version)
+def list_project_summaries(customer_id, after=None, limit=PAGE_SIZE):
+    """
+    Get one page of a customer's projects, newest first, without descriptions or inputs:
+    (id, title, status, project_type, pm_estimate, it_director_estimate, created_at) rows.
+    Paged like list_projects; returns (summaries, next_cursor).
+    """
+    params = [customer_id]
+    if after is not None:
+        params.extend(after)
+    sql = SQL_PROJECT_SUMMARIES.format(after='AND (created_at, id) < (?, ?)' if after is not None else '')
+    
+    try:
+        with connection() as conn:
+            summaries = conn.execute(sql, params + [limit + 1]).fetchall()
+    except Exception as e:
+        logger.error("Error listing project summaries: %s", e)
+        return [], None
+    
+    if len(summaries) <= limit:
+        return summaries, None
+    summaries = summaries[:limit]
+    return summaries, (summaries[-1][6], summaries[-1][0])
+
+@_cached(lambda *args, **kwargs: _listing_version)
+def count_projects(status=None, project_type=None, customer_id=None):
+    """Count the projects matching the listing filters"""
+    conditions, params = _project_filters(status, project_type, customer_id)
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    try:
+        with connection() as conn:
+            return conn.execute(SQL_COUNT_PROJECTS.format(where=where), params).fetchone()[0]
+    except Exception as e:
+        logger.error("Error counting projects: %s", e)
+        return 0
+
+# Column names of the get_project_timeline results
+TIMELINE_COLUMNS = ('created_at', 'project_type', 'status', 'title', 'customer_name')
+TIMELINE_WEEK_COLUMNS = ('week', 'project_type', 'status', 'count')
+
+@_cached(lambda *args, **kwargs: _listing_version)
+def get_project_timeline(max_points):
+    """
+    Get the projects for the timeline as a dict of column name -> list of values, so
+    a DataFrame can be built from it without going through row tuples.
+    Up to max_points projects are returned one by one (TIMELINE_COLUMNS); beyond that
+    they are counted per week, project type and status in the query (TIMELINE_WEEK_COLUMNS).
+    """
+    weekly = count_projects() > max_points
+    columns = TIMELINE_WEEK_COLUMNS if weekly else TIMELINE_COLUMNS
+    try:
+        with connection() as conn:
+            rows = conn.execute(SQL_TIMELINE_WEEKS if weekly else SQL_TIMELINE_PROJECTS).fetchall()
+    except Exception as e:
+        logger.error("Error getting project timeline: %s", e)
+        rows = []
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {name: list(column) for name, column in zip(columns, values)}
 
 def update_project_status(project_id, status, estimate=None):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        print(f"\n=== Updating project {project_id} status to {status} ===")
-        
-        # Проверим текущий статус проекта
-        c.execute('SELECT status FROM projects WHERE id = ?', (project_id,))
-        current_status = c.fetchone()
-        print(f"Current project status: {current_status[0] if current_status else 'Not found'}")
-        
-        if estimate is not None:
-            c.execute('UPDATE projects SET status = ?, pm_estimate = ? WHERE id = ?', (status, estimate, project_id))
-            print(f"Updated project {project_id} with status {status} and estimate {estimate}")
-        else:
-            c.execute('UPDATE projects SET status = ? WHERE id = ?', (status, project_id))
-            print(f"Updated project {project_id} with status {status}")
-        
-        # Проверим новый статус
-        c.execute('SELECT status FROM projects WHERE id = ?', (project_id,))
-        new_status = c.fetchone()
-        print(f"New project status: {new_status[0] if new_status else 'Not found'}")
-        
-        conn.commit()
+        with transaction() as conn:
+            if estimate is not None:
+                conn.execute('UPDATE projects SET status = ?, pm_estimate = ? WHERE id = ?', (status, estimate, project_id))
+            else:
+                conn.execute('UPDATE projects SET status = ? WHERE id = ?', (status, project_id))
+            _invalidate(project_id, listings=True)
+        logger.debug("Updated project %s with status %s", project_id, status)
     except Exception as e:
-        print(f"Error updating project status: {e}")
-    finally:
-        conn.close()
+        logger.error("Error updating project status: %s", e)
+
+def _encode_input_value(value):
+    """
+    Convert an input value into its (value_num, value_text, value_json) columns.
+    Exactly one column is set, or none for a None value.
+    """
+    if isinstance(value, (int, float)):
+        return float(value), None, None
+    if isinstance(value, str):
+        return None, value, None
+    if value is None:
+        return None, None, None
+    return None, None, json.dumps(value)
+
+def _decode_input_value(value_num, value_text, value_json):
+    """Convert the typed project_inputs columns back into the Python value"""
+    if value_num is not None:
+        return value_num
+    if value_text is not None:
+        return value_text
+    if value_json is not None:
+        return json.loads(value_json)
+    return None
+
+def _decode_legacy_value(value):
+    """Convert a value stored by the old single-column format back into its Python value"""
+    try:
+        # Try to parse JSON if the value looks like a JSON string
+        if isinstance(value, str) and (value.startswith('{') or value.startswith('[')):
+            return json.loads(value)
+        # Convert numeric strings to float
+        if isinstance(value, str) and value.replace('.', '').isdigit():
+            return float(value)
+    except json.JSONDecodeError:
+        # If not JSON, keep the original value
+        pass
+    return value
+
+def _migrate_legacy_inputs(c):
+    """Move inputs from the old single REAL value column into the typed columns and role hours table"""
+    logger.info("Migrating project inputs to typed storage")
+    c.execute('DROP INDEX IF EXISTS idx_project_inputs_project_type')
+    c.execute('ALTER TABLE project_inputs RENAME TO project_inputs_legacy')
+    c.execute(SQL_CREATE_PROJECT_INPUTS)
+    c.execute('''CREATE UNIQUE INDEX idx_project_inputs_project_type
+                 ON project_inputs (project_id, input_type)''')
+    
+    rows = c.execute('SELECT project_id, input_type, value FROM project_inputs_legacy ORDER BY id').fetchall()
+    inputs = []
+    role_hours = []
+    for project_id, input_type, value in rows:
+        value = _decode_legacy_value(value)
+        if input_type == ROLE_HOURS_INPUT and isinstance(value, dict):
+            role_hours.extend((project_id, role, float(hours)) for role, hours in value.items())
+        else:
+            inputs.append((project_id, input_type) + _encode_input_value(value))
+    
+    c.executemany(SQL_UPSERT_PROJECT_INPUT, inputs)
+    c.executemany(SQL_UPSERT_ROLE_HOURS, role_hours)
+    c.execute('DROP TABLE project_inputs_legacy')
 
 def save_project_inputs(project_id, inputs):
-    """Save project inputs to the database"""
+    """
+    Save project inputs to the database.
+    Only inputs whose stored value differs are written; inputs missing from
+    the dictionary are left untouched. Returns the number of rows written.
+    """
     try:
-        # First, delete existing inputs for this project
-        conn = sqlite3.connect('impact_calculator.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM project_inputs WHERE project_id = ?", (project_id,))
-        
-        # Insert new inputs
-        for input_type, value in inputs.items():
-            # Convert dictionary to JSON string if value is a dictionary
-            if isinstance(value, dict):
-                value = json.dumps(value)
-            # Convert list to JSON string if value is a list
-            elif isinstance(value, list):
-                value = json.dumps(value)
+        with transaction() as conn:
+            stored = {row[0]: row[1:] for row in conn.execute(SQL_PROJECT_INPUTS, (project_id,)).fetchall()}
             
-            cursor.execute("""
-                INSERT INTO project_inputs (project_id, input_type, value)
-                VALUES (?, ?, ?)
-            """, (project_id, input_type, value))
-        
-        conn.commit()
-        print(f"Successfully saved inputs for project {project_id}")
+            changed = []
+            for input_type, value in inputs.items():
+                if input_type == ROLE_HOURS_INPUT:
+                    continue
+                columns = _encode_input_value(value)
+                if stored.get(input_type) == columns:
+                    continue
+                changed.append((project_id, input_type) + columns)
+            
+            # Role hours are stored one row per role
+            changed_roles = []
+            removed_roles = []
+            if ROLE_HOURS_INPUT in inputs:
+                role_hours = inputs[ROLE_HOURS_INPUT] or {}
+                stored_hours = dict(conn.execute(SQL_PROJECT_ROLE_HOURS, (project_id,)).fetchall())
+                changed_roles = [(project_id, role, float(hours)) for role, hours in role_hours.items()
+                                 if stored_hours.get(role) != float(hours)]
+                removed_roles = [(project_id, role) for role in stored_hours if role not in role_hours]
+            
+            if changed:
+                conn.executemany(SQL_UPSERT_PROJECT_INPUT, changed)
+            if changed_roles:
+                conn.executemany(SQL_UPSERT_ROLE_HOURS, changed_roles)
+            if removed_roles:
+                conn.executemany(SQL_DELETE_ROLE_HOURS, removed_roles)
+            
+            touched = len(changed) + len(changed_roles) + len(removed_roles)
+            if touched:
+                _invalidate(project_id)
+            
+            # Queue a background ROI recalculation when an input it depends on changed
+            if changed_roles or removed_roles or any(row[1] in roi.ROI_INPUT_KEYS for row in changed):
+                conn.execute(SQL_ENQUEUE_ROI_JOB, (project_id,))
         
+        logger.debug("Saved inputs for project %s (%d changed)", project_id, touched)
+        return touched
+    
     except Exception as e:
-        print(f"Error saving project inputs: {str(e)}")
-        conn.rollback()
+        logger.error("Error saving project inputs: %s", e)
         raise
 
+@_cached(_project_version)
 def get_project_inputs(project_id):
     """Get all inputs for a specific project"""
     try:
-        conn = sqlite3.connect('impact_calculator.db')
-        cursor = conn.cursor()
-        
-        print(f"\n=== Getting inputs for project {project_id} ===")
-        
-        # Get all inputs for the project
-        cursor.execute("""
-            SELECT input_type, value
-            FROM project_inputs
-            WHERE project_id = ?
-        """, (project_id,))
-        
-        inputs = {}
-        for input_type, value in cursor.fetchall():
-            try:
-                # Try to parse JSON if the value looks like a JSON string
-                if isinstance(value, str) and (value.startswith('{') or value.startswith('[')):
-                    value = json.loads(value)
-                # Convert numeric strings to float
-                elif isinstance(value, str) and value.replace('.', '').isdigit():
-                    value = float(value)
-                inputs[input_type] = value
-            except json.JSONDecodeError:
-                # If not JSON, keep the original value
-                inputs[input_type] = value
+        with connection() as conn:
+            # Get all inputs for the project
+            rows = conn.execute(SQL_PROJECT_INPUTS, (project_id,)).fetchall()
+            role_rows = conn.execute(SQL_PROJECT_ROLE_HOURS, (project_id,)).fetchall()
         
-        print(f"Final input dictionary: {inputs}")
+        inputs = {row[0]: _decode_input_value(*row[1:]) for row in rows}
+        if role_rows:
+            inputs[ROLE_HOURS_INPUT] = dict(role_rows)
         return inputs
-        
+    
     except Exception as e:
-        print(f"Error getting project inputs: {str(e)}")
+        logger.error("Error getting project inputs: %s", e)
         return {}
-    finally:
-        if conn:
-            conn.close()
+
+def get_project_inputs_many(project_ids):
+    """
+    Get the inputs of several projects at once.
+    Returns {project_id: inputs}; projects without inputs map to an empty dictionary.
+    """
+    project_ids = list(dict.fromkeys(project_ids))
+    result = {project_id: {} for project_id in project_ids}
+    try:
+        with connection() as conn:
+            for start in range(0, len(project_ids), MAX_QUERY_PARAMS):
+                chunk = project_ids[start:start + MAX_QUERY_PARAMS]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor = conn.execute(SQL_PROJECT_INPUTS_MANY.format(placeholders=placeholders), chunk)
+                for project_id, input_type, value_num, value_text, value_json in cursor.fetchall():
+                    result[project_id][input_type] = _decode_input_value(value_num, value_text, value_json)
+                
+                cursor = conn.execute(SQL_PROJECT_ROLE_HOURS_MANY.format(placeholders=placeholders), chunk)
+                for project_id, role, hours in cursor.fetchall():
+                    result[project_id].setdefault(ROLE_HOURS_INPUT, {})[role] = hours
+        return result
+    except Exception as e:
+        logger.error("Error getting project inputs: %s", e)
+        return result
 
 def check_database():
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
+    """Print the content of every table; a manual diagnostic that is never called by the app"""
     try:
-        print("\n=== Database Content Check ===")
-        
-        # Check users table
-        print("\nUsers table:")
-        c.execute('SELECT * FROM users')
-        users = c.fetchall()
-        for user in users:
-            print(f"ID: {user[0]}, Username: {user[1]}, Role: {user[3]}")
-        
-        # Check projects table
-        print("\nProjects table:")
-        c.execute('SELECT * FROM projects')
-        projects = c.fetchall()
-        for project in projects:
-            print(f"ID: {project[0]}, Title: {project[1]}, Customer ID: {project[5]}, Status: {project[4]}")
-        
-        # Check project inputs table
-        print("\nProject inputs table:")
-        c.execute('SELECT * FROM project_inputs')
-        inputs = c.fetchall()
-        for input in inputs:
-            print(f"ID: {input[0]}, Project ID: {input[1]}, Type: {input[2]}, Value: {input[3]}")
+        with connection() as conn:
+            c = conn.cursor()
+            print("\n=== Database Content Check ===")
+            
+            # Check users table
+            print("\nUsers table:")
+            c.execute(SQL_ALL_USERS)
+            users = c.fetchall()
+            for user in users:
+                print(f"ID: {user[0]}, Username: {user[1]}, Role: {user[3]}")
             
+            # Check projects table
+            print("\nProjects table:")
+            c.execute(SQL_ALL_PROJECTS_RAW)
+            projects = c.fetchall()
+            for project in projects:
+                print(f"ID: {project[0]}, Title: {project[1]}, Customer ID: {project[5]}, Status: {project[4]}")
+            
+            # Check project inputs table
+            print("\nProject inputs table:")
+            c.execute(SQL_ALL_PROJECT_INPUTS)
+            inputs = c.fetchall()
+            for input in inputs:
+                value = _decode_input_value(input[3], input[4], input[5])
+                print(f"ID: {input[0]}, Project ID: {input[1]}, Type: {input[2]}, Value: {value}")
+    
     except Exception as e:
         print(f"Error checking database: {e}")
-    finally:
-        conn.close()
 
 def get_projects_by_status(status):
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        print(f"\n=== Getting projects with status: {status} ===")
-        
-        # Сначала проверим все проекты
-        c.execute('SELECT * FROM projects')
-        all_projects = c.fetchall()
-        print(f"Total projects in database: {len(all_projects)}")
-        for p in all_projects:
-            print(f"Project ID: {p[0]}, Title: {p[1]}, Status: {p[4]}")
-        
-        # Теперь получим проекты с нужным статусом
-        c.execute('''SELECT p.*, u.username as customer_name 
-                     FROM projects p 
-                     LEFT JOIN users u ON p.customer_id = u.id
-                     WHERE p.status = ?''', (status,))
-        projects = c.fetchall()
-        print(f"Found {len(projects)} projects with status {status}")
-        
-        for project in projects:
-            print(f"\nProject details:")
-            print(f"ID: {project[0]}")
-            print(f"Title: {project[1]}")
-            print(f"Status: {project[4]}")
-            print(f"Customer ID: {project[5]}")
-            print(f"Customer Name: {project[9]}")
-            
+        with connection() as conn:
+            projects = conn.execute(SQL_PROJECTS_BY_STATUS, (status,)).fetchall()
+        logger.debug("Found %d projects with status %s", len(projects), status)
         return projects
     except Exception as e:
-        print(f"Error getting projects by status: {e}")
+        logger.error("Error getting projects by status: %s", e)
         return []
-    finally:
-        conn.close()
 
+@_cached(_project_version)
 def get_project(project_id):
     """Get a specific project by ID"""
-    conn = sqlite3.connect('impact_calculator.db')
-    c = conn.cursor()
     try:
-        c.execute('''
-            SELECT p.*, u.username as customer_name
-            FROM projects p
-            LEFT JOIN users u ON p.customer_id = u.id
-            WHERE p.id = ?
-        ''', (project_id,))
-        project = c.fetchone()
-        return project
+        with connection() as conn:
+            c = conn.execute(SQL_PROJECT, (project_id,))
+            return c.fetchone()
     except Exception as e:
-        print(f"Error getting project: {e}")
+        logger.error("Error getting project: %s", e)
         return None
-    finally:
-        conn.close() 
\ No newline at end of file
+
+@_cached(_roi_version)
+def get_project_roi(project_id):
+    """
+    Get the stored ROI result of a project, or None if it was never calculated.
+    The result carries the 'input_hash' of the inputs it was calculated from.
+    """
+    try:
+        with connection() as conn:
+            row = conn.execute(SQL_PROJECT_ROI, (project_id,)).fetchone()
+    except Exception as e:
+        logger.error("Error getting project ROI: %s", e)
+        return None
+    
+    if row is None:
+        return None
+    return {
+        'input_hash': row[0],
+        'total_benefits': row[1],
+        'total_costs': row[2],
+        'roi': row[3],
+        'benefits_breakdown': {
+            'expected_revenue': row[4],
+            'time_savings': row[5],
+            'efficiency_improvement': row[6]
+        },
+        'costs_breakdown': {
+            'labor': row[7],
+            'infrastructure': row[8],
+            'software': row[9],
+            'training': row[10]
+        }
+    }
+
+def save_project_roi(project_id, input_hash, roi_data):
+    """Store the ROI result calculated from the inputs identified by input_hash"""
+    benefits = roi_data['benefits_breakdown']
+    costs = roi_data['costs_breakdown']
+    with transaction() as conn:
+        conn.execute(SQL_UPSERT_PROJECT_ROI, (
+            project_id, input_hash,
+            roi_data['total_benefits'], roi_data['total_costs'], roi_data['roi'],
+            benefits['expected_revenue'], benefits['time_savings'], benefits['efficiency_improvement'],
+            costs['labor'], costs['infrastructure'], costs['software'], costs['training']
+        ))
+        _invalidate(project_id, scope='roi')
+
+def save_project_roi_many(rows):
+    """
+    Store many ROI results in one transaction.
+    rows are (project_id, input_hash, total_benefits, total_costs, roi, expected_revenue,
+    time_savings, efficiency_improvement, labor_cost, infrastructure_cost, software_cost,
+    training_cost) tuples.
+    """
+    with transaction() as conn:
+        conn.executemany(SQL_UPSERT_PROJECT_ROI, rows)
+        for row in rows:
+            _invalidate(row[0], scope='roi')
+
+def enqueue_roi_jobs(project_ids):
+    """Queue ROI recalculations; a project that is already queued keeps a single job"""
+    with transaction() as conn:
+        conn.executemany(SQL_ENQUEUE_ROI_JOB, [(project_id,) for project_id in project_ids])
+
+def enqueue_all_roi_jobs():
+    """Queue an ROI recalculation for every project. Returns the number of queued projects."""
+    with transaction() as conn:
+        return conn.execute(SQL_ENQUEUE_ALL_ROI_JOBS).rowcount
+
+def claim_roi_jobs(limit):
+    """
+    Mark up to limit pending jobs as running and return them as (project_id, generation).
+    The generation identifies the request, so a job queued again while running is not lost.
+    """
+    with transaction() as conn:
+        jobs = conn.execute(SQL_PENDING_ROI_JOBS, (limit,)).fetchall()
+        if jobs:
+            conn.executemany(SQL_START_ROI_JOB, [(project_id,) for project_id, _ in jobs])
+    return jobs
+
+def finish_roi_job(project_id, generation, error=None):
+    """Mark a claimed job as done, or as failed when error is given"""
+    with transaction() as conn:
+        conn.execute(SQL_FINISH_ROI_JOB, ('failed' if error else 'done', error, project_id, generation))
+
+def requeue_stale_roi_jobs(minutes):
+    """Put jobs that have been running for longer than minutes back in the queue"""
+    with transaction() as conn:
+        return conn.execute(SQL_REQUEUE_STALE_ROI_JOBS, (f'-{int(minutes)} minutes',)).rowcount
+
+def get_roi_job_progress():
+    """Count the ROI jobs per status"""
+    try:
+        with connection() as conn:
+            return dict(conn.execute(SQL_ROI_JOB_PROGRESS).fetchall())
+    except Exception as e:
+        logger.error("Error getting ROI job progress: %s", e)
+        return {}
+
+def request_recost():
+    """Request a bulk re-cost of every project by the background worker"""
+    with transaction() as conn:
+        conn.execute(SQL_REQUEST_RECOST)
+
+def request_recost_if_computed_before(timestamp):
+    """
+    Request a bulk re-cost if any stored ROI result was calculated before timestamp
+    (a UTC date and time, like computed_at). Returns True if one was requested.
+    """
+    with transaction() as conn:
+        if conn.execute(SQL_ROI_COMPUTED_BEFORE, (str(timestamp),)).fetchone() is None:
+            return False
+        conn.execute(SQL_REQUEST_RECOST)
+    return True
+
+def claim_recost(stale_minutes):
+    """
+    Mark a requested re-cost as running and return its generation, or None if there is
+    none. A re-cost running for longer than stale_minutes is claimed again.
+    """
+    with transaction() as conn:
+        row = conn.execute(SQL_PENDING_RECOST, (f'-{int(stale_minutes)} minutes',)).fetchone()
+        if row:
+            conn.execute(SQL_START_RECOST)
+    return row[0] if row else None
+
+def finish_recost(generation, error=None):
+    """Mark a claimed re-cost as done, or as failed when error is given; a newer request stays pending"""
+    with transaction() as conn:
+        conn.execute(SQL_FINISH_RECOST, ('failed' if error else 'done', error, generation))
+
+def get_recost_status():
+    """Status, error, enqueued_at and finished_at of the latest re-cost request as a dictionary, or None"""
+    try:
+        with connection() as conn:
+            row = conn.execute(SQL_RECOST_STATUS).fetchone()
+    except Exception as e:
+        logger.error("Error getting re-cost status: %s", e)
+        return None
+    return dict(zip(('status', 'error', 'enqueued_at', 'finished_at'), row)) if row else None
+
+def get_portfolio_rows(input_types):
+    """
+    Load every project with its numeric inputs and role hours for portfolio calculations.
+    Returns (projects, inputs, role_hours) where projects are (id, title, project_type, status)
+    rows, inputs are (project_id, input_type, value) rows limited to input_types and
+    role_hours are (project_id, role, hours) rows.
+    """
+    input_types = list(input_types)
+    with connection() as conn:
+        projects = conn.execute(SQL_PORTFOLIO_PROJECTS).fetchall()
+        placeholders = ', '.join('?' * len(input_types))
+        inputs = conn.execute(SQL_PORTFOLIO_INPUTS.format(placeholders=placeholders), input_types).fetchall()
+        role_hours = conn.execute(SQL_PORTFOLIO_ROLE_HOURS).fetchall()
+    return projects, inputs, role_hours
+
+def get_rates():
+    """Get every rate card entry as (id, role, project_type, hourly_rate, effective_from), oldest first"""
+    try:
+        with connection() as conn:
+            return conn.execute(SQL_RATES).fetchall()
+    except Exception as e:
+        logger.error("Error getting rates: %s", e)
+        return []
+
+def get_rates_revision():
+    """Cheap fingerprint of the rates table that changes whenever a rate is saved or deleted"""
+    with connection() as conn:
+        return tuple(conn.execute(SQL_RATES_REVISION).fetchone())
+
+def save_rate(role, hourly_rate, effective_from, project_type=None):
+    """
+    Set the hourly rate of a role from effective_from (an ISO date) on, for one project
+    type or for every type when project_type is None. Replaces an entry with the same
+    role, project type and date. A rate already in effect requests a bulk re-cost of every
+    project in the same transaction; the background worker requests one for a later rate
+    once it takes effect. Returns True if a re-cost was requested.
+    """
+    in_effect = str(effective_from) <= date.today().isoformat()
+    with transaction() as conn:
+        conn.execute(SQL_UPSERT_RATE, (role, project_type or '', float(hourly_rate), str(effective_from)))
+        if in_effect:
+            conn.execute(SQL_REQUEST_RECOST)
+    logger.info("Saved rate %s for %s (%s) from %s", hourly_rate, role, project_type or 'all types', effective_from)
+    return in_effect
+
+def delete_rate(rate_id):
+    """
+    Remove a rate. Removing a rate already in effect requests a bulk re-cost of every
+    project in the same transaction. Returns True if a re-cost was requested.
+    """
+    with transaction() as conn:
+        row = conn.execute(SQL_RATE_EFFECTIVE_FROM, (rate_id,)).fetchone()
+        conn.execute(SQL_DELETE_RATE, (rate_id,))
+        in_effect = row is not None and row[0] <= date.today().isoformat()
+        if in_effect:
+            conn.execute(SQL_REQUEST_RECOST)
+    logger.info("Deleted rate %s", rate_id)
+    return in_effect
+
+def get_formulas():
+    """Get every stored formula as (id, name, project_type, expression), oldest first"""
+    try:
+        with connection() as conn:
+            return conn.execute(SQL_FORMULAS).fetchall()
+    except Exception as e:
+        logger.error("Error getting formulas: %s", e)
+        return []
+
+def get_formulas_revision():
+    """Cheap fingerprint of the formulas table that changes whenever a formula is saved or deleted"""
+    with connection() as conn:
+        return tuple(conn.execute(SQL_FORMULAS_REVISION).fetchone())
+
+def save_formula(name, expression, project_type=None):
+    """
+    Set the expression of a benefit or cost formula for one project type, or for every
+    type when project_type is None, and request a bulk re-cost of every project in the same
+    transaction. Check it with formulas.check_formula first.
+    """
+    with transaction() as conn:
+        conn.execute(SQL_UPSERT_FORMULA, (name, project_type or '', expression))
+        conn.execute(SQL_REQUEST_RECOST)
+    logger.info("Saved formula %s for %s: %s", name, project_type or 'all types', expression)
+
+def delete_formula(formula_id):
+    """
+    Remove a stored formula, so its project types fall back to the formula for all types or
+    the standard one, and request a bulk re-cost of every project in the same transaction.
+    Check it with formulas.check_formula_removal first.
+    """
+    with transaction() as conn:
+        conn.execute(SQL_DELETE_FORMULA, (formula_id,))
+        conn.execute(SQL_REQUEST_RECOST)
+    logger.info("Deleted formula %s", formula_id)
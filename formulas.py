@@ -0,0 +1,148 @@
+import logging
+import threading
+import database as db
+import rates
+import roi
+
+logger = logging.getLogger(__name__)
+
+# Projects every change of the formulas is tried on before it is saved, besides the stored
+# projects it applies to: {description: inputs}
+SAMPLE_PROJECTS = {
+    'a project without revenue or costs': {},
+    'a typical project': {
+        'expected_revenue': 100000,
+        'time_savings': 10000,
+        'efficiency_improvement': 10,
+        'project_duration': 6,
+        'role_hours': {'Project Manager': 80, 'Backend Developer': 400},
+        'infrastructure_cost': 5000,
+        'software_licenses': 2000,
+        'training_cost': 1000,
+        'maintenance_period': 12,
+    },
+}
+
+_lock = threading.Lock()
+_registry = None
+_registry_revision = None
+
+def _compile(expressions, project_type):
+    try:
+        return roi.compile_formulas(expressions)
+    except ValueError as e:
+        logger.error("Invalid formulas for %s, using the standard ones: %s", project_type or 'all types', e)
+        return roi.DEFAULT_FORMULAS
+
+class FormulaRegistry:
+    """
+    Compiled formulas of every project type: roi.FORMULAS, replaced by the formulas stored
+    for all project types, then by those stored for the type itself.
+    """
+    
+    def __init__(self, rows):
+        # Stored formulas for all types
+        self.shared = {}
+        self.overrides = {}
+        for _, name, project_type, expression in rows:
+            if project_type:
+                self.overrides.setdefault(project_type, {})[name] = expression
+            else:
+                self.shared[name] = expression
+        
+        self.default = _compile(dict(roi.FORMULAS, **self.shared), None)
+        self._by_type = {project_type: _compile(dict(self.default.expressions, **expressions), project_type)
+                         for project_type, expressions in self.overrides.items()}
+    
+    def for_type(self, project_type=None):
+        """FormulaSet of one project type"""
+        return self._by_type.get(project_type, self.default)
+    
+    def for_types(self, project_types):
+        """FormulaSet of each project, for roi.calculate_roi_batch"""
+        return [self.for_type(project_type) for project_type in project_types]
+
+def formula_registry():
+    """
+    Return the formula registry, kept in memory and rebuilt only when the formulas table
+    changed. Compiled formula sets are shared through roi.compile_formulas.
+    """
+    global _registry, _registry_revision
+    revision = db.get_formulas_revision()
+    with _lock:
+        if _registry_revision != revision:
+            _registry = FormulaRegistry(db.get_formulas())
+            _registry_revision = revision
+        return _registry
+
+def _changed_formulas(registry, name, expression, project_type):
+    """
+    Formula expressions of every project type affected by setting a formula, or by removing
+    the stored one when expression is None. Returns ({project type: expressions}, the types
+    with overrides afterwards); None stands for the types without overrides.
+    """
+    shared = dict(registry.shared)
+    overrides = {other_type: dict(expressions) for other_type, expressions in registry.overrides.items()}
+    changed = shared if project_type is None else overrides.setdefault(project_type, {})
+    if expression is None:
+        changed.pop(name, None)
+    else:
+        changed[name] = expression
+    
+    if project_type:
+        affected = [project_type]
+    else:
+        # Types overriding the formula keep their own expression
+        affected = [None] + [other_type for other_type, expressions in overrides.items() if name not in expressions]
+    defaults = dict(roi.FORMULAS, **shared)
+    candidates = {affected_type: dict(defaults, **overrides.get(affected_type, {})) for affected_type in affected}
+    return candidates, [other_type for other_type, expressions in overrides.items() if expressions]
+
+def _try_formulas(candidates, overridden_types):
+    """
+    Compile the formulas of each affected project type and evaluate them on SAMPLE_PROJECTS
+    and the stored projects of that type. Raises ValueError if they do not compile or a
+    required formula has no finite value for one of those projects, as its ROI would be
+    stored as 0.
+    """
+    # portfolio imports this module, so it is only loaded when formulas are checked
+    import portfolio
+    
+    projects, columns, roles = portfolio.load_portfolio_columns()
+    project_types = projects['project_type']
+    sample_columns, sample_roles = roi.columns_from_inputs(list(SAMPLE_PROJECTS.values()))
+    card = rates.rate_card()
+    for project_type, expressions in candidates.items():
+        formula_set = roi.compile_formulas(expressions)
+        if project_type is None:
+            rows = (~project_types.isin(overridden_types)).to_numpy()
+        else:
+            rows = (project_types == project_type).to_numpy()
+        trials = [
+            (list(SAMPLE_PROJECTS), sample_columns, sample_roles,
+             roi.role_rates(sample_roles, card.rates_for(project_type))),
+            ([f"project '{title}'" for title in projects['title'][rows]],
+             {key: column[rows] for key, column in columns.items()}, roles,
+             card.rate_matrix(roles, project_types[rows])),
+        ]
+        for descriptions, trial_columns, trial_roles, trial_rates in trials:
+            undefined = roi.undefined_formulas(trial_columns, trial_roles, trial_rates, formula_set)
+            if undefined:
+                row, name = undefined
+                raise ValueError(f"Formula {name} has no value for {descriptions[row]}, e.g. because of a "
+                                 f"division by zero; guard it, as in 'a / b if b != 0 else 0'")
+
+def check_formula(name, expression, project_type=None):
+    """
+    Raise ValueError if setting the formula for one project type (all types when None)
+    would leave any type with formulas that do not compile, or that have no finite
+    value for a sample or stored project of that type.
+    """
+    _try_formulas(*_changed_formulas(formula_registry(), name, expression, project_type))
+
+def check_formula_removal(name, project_type=None):
+    """
+    Raise ValueError, like check_formula, if removing the stored formula of one project
+    type (all types when None) would leave any type with formulas that do not work.
+    """
+    _try_formulas(*_changed_formulas(formula_registry(), name, None, project_type))
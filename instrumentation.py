@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import bisect
+import functools
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Queries slower than this are logged as warnings
+SLOW_QUERY_MS = float(os.environ.get('ROI_SLOW_QUERY_MS', 200))
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+# Source files whose frames are skipped when looking for a query's call site
+_INTERNAL_FILES = (os.path.abspath(__file__),)
+
+# Cursor, connection and decorator frames that never name the data access function
+_PLUMBING_FUNCTIONS = {'execute', 'executemany', 'fetchone', 'fetchall', 'wrapper', 'connection', 'transaction'}
+
+_lock = threading.Lock()
+_local = threading.local()
+# Code object -> (internal, skipped, "file.py" name); resolved once per function
+_code_files = {}
+# SQL text -> the same statement on one line
+_statements = {}
+_query_stats = {}
+_render_stats = {}
+
+def register_internal_file(path):
+    """Treat frames from path as internal, so the call site reported is its caller"""
+    global _INTERNAL_FILES
+    _INTERNAL_FILES = _INTERNAL_FILES + (os.path.abspath(path),)
+    _code_files.clear()
+
+def _code_file(code):
+    info = _code_files.get(code)
+    if info is None:
+        filename = os.path.abspath(code.co_filename)
+        info = _code_files[code] = (filename in _INTERNAL_FILES, 'contextlib' in filename, os.path.basename(filename))
+    return info
+
+def _call_site():
+    """
+    Find where a query was issued: the innermost public data access function
+    that ran it, and the first frame outside the instrumented modules.
+    """
+    function = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        internal, skipped, basename = _code_file(code)
+        if internal:
+            if function is None and not code.co_name.startswith('_') and code.co_name not in _PLUMBING_FUNCTIONS:
+                function = code.co_name
+        elif not skipped:
+            return function or code.co_name, f"{basename}:{frame.f_lineno} {code.co_name}"
+        frame = frame.f_back
+    return function or '?', '?'
+
+def record_query(sql, seconds, rows):
+    """Record the latency and row count of one executed statement"""
+    elapsed_ms = seconds * 1000
+    function, caller = _call_site()
+    statement = _statements.get(sql)
+    if statement is None:
+        statement = _statements[sql] = ' '.join(sql.split())
+    
+    with _lock:
+        stats = _query_stats.get((function, statement))
+        if stats is None:
+            stats = _query_stats[(function, statement)] = {
+                'function': function,
+                'sql': statement,
+                'calls': 0,
+                'rows': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'histogram': [0] * (len(HISTOGRAM_BOUNDS_MS) + 1),
+                'call_sites': Counter()
+            }
+        stats['calls'] += 1
+        stats['rows'] += rows
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['histogram'][bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+        stats['call_sites'][caller] += 1
+    
+    render = getattr(_local, 'render', None)
+    if render is not None:
+        render['queries'] += 1
+        render['query_ms'] += elapsed_ms
+    
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms, %d rows) in %s from %s: %s", elapsed_ms, rows, function, caller, statement)
+    else:
+        logger.debug("Query (%.1f ms, %d rows) in %s: %s", elapsed_ms, rows, function, statement)
+
+@contextmanager
+def track_render(page):
+    """Count the queries and time spent while rendering one page"""
+    render = _local.render = {'queries': 0, 'query_ms': 0.0}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.render = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _lock:
+            stats = _render_stats.setdefault(page, {
+                'page': page,
+                'renders': 0,
+                'queries': 0,
+                'query_ms': 0.0,
+                'render_ms': 0.0,
+                'last_queries': 0
+            })
+            stats['renders'] += 1
+            stats['queries'] += render['queries']
+            stats['query_ms'] += render['query_ms']
+            stats['render_ms'] += elapsed_ms
+            stats['last_queries'] = render['queries']
+
+def track_fragment(func):
+    """
+    Count the queries of a Streamlit fragment's own reruns as renders of a page named
+    after the fragment. Within a full page render they count towards that page.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'render', None) is not None:
+            return func(*args, **kwargs)
+        with track_render(f"{func.__name__} (fragment)"):
+            return func(*args, **kwargs)
+    return wrapper
+
+def slowest_queries(limit=20):
+    """Return the recorded queries with the highest maximum latency first"""
+    with _lock:
+        queries = [dict(stats, histogram=list(stats['histogram']), call_sites=dict(stats['call_sites']))
+                   for stats in _query_stats.values()]
+    queries.sort(key=lambda q: q['max_ms'], reverse=True)
+    return queries[:limit]
+
+def render_stats():
+    """Return the query counts and timings per rendered page"""
+    with _lock:
+        return [dict(stats) for stats in _render_stats.values()]
+
+def reset():
+    with _lock:
+        _query_stats.clear()
+        _render_stats.clear()
@@ -1,7 +1,19 @@
+import os
+import logging
 import streamlit as st
+import cashflow
 import database as db
+import formulas
+import instrumentation
+import portfolio
+import rates
+import roi
+import sensitivity
+import simulation
 import utils
-from datetime import datetime
+import whatif
+import worker
+from datetime import date, datetime
 import plotly.graph_objects as go
 
 # Set page config at the very beginning
@@ -12,8 +24,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize the database
-db.init_db()
+# Diagnostic output is quiet unless ROI_LOG_LEVEL asks for more
+logging.basicConfig(level=os.environ.get('ROI_LOG_LEVEL', 'WARNING'))
+logger = logging.getLogger(__name__)
+
+# Initialize the database; only the first run in a process creates the schema
+db.ensure_schema()
+
+# Recalculate queued ROI results off the request path
+worker.start_background_worker()
 
 # Initialize session state
 if 'user' not in st.session_state:
@@ -21,6 +40,69 @@ if 'user' not in st.session_state:
 if 'page' not in st.session_state:
     st.session_state.page = 'login'
 
+PROJECT_TYPES = ["New Development", "Enhancement", "Maintenance", "Support"]
+PROJECT_STATUSES = ['submitted', 'estimated_by_pm', 'approved_by_it']
+# Number of projects shown in the portfolio table; the CSV export has all of them
+PORTFOLIO_ROWS = 100
+PORTFOLIO_RANKINGS = ['npv', 'roi', 'irr']
+OPTIMIZER_OBJECTIVES = {'total_benefits': 'Total Benefits', 'npv': 'NPV'}
+SIMULATION_DISTRIBUTIONS = ['triangular', 'pert', 'normal']
+SIMULATION_SCENARIOS = [10_000, 100_000, 1_000_000]
+# Projects listed per page on the customer dashboard
+CUSTOMER_PROJECTS_PER_PAGE = 20
+
+def project_picker(key):
+    """
+    Paged project selector with status and type filters.
+    Returns the selected project row, or None if no project matches.
+    """
+    col1, col2 = st.columns(2)
+    with col1:
+        status = st.selectbox("Status", ["All"] + PROJECT_STATUSES, key=f"{key}_status",
+                              format_func=lambda s: s if s == "All" else s.replace('_', ' ').title())
+    with col2:
+        project_type = st.selectbox("Type", ["All"] + PROJECT_TYPES, key=f"{key}_type")
+    filters = {
+        'status': None if status == "All" else status,
+        'project_type': None if project_type == "All" else project_type
+    }
+    
+    # Keep the cursor of every visited page so "Previous" can go back
+    pages_key = f"{key}_pages"
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[pages_key] = [None]
+    cursors = st.session_state[pages_key]
+    
+    projects, next_cursor = db.list_projects(after=cursors[-1], **filters)
+    if not projects:
+        return None
+    
+    project_rows = {p[0]: p for p in projects}
+    selected_project_id = st.selectbox(
+        "Select Project",
+        options=list(project_rows.keys()),
+        format_func=lambda x: f"{project_rows[x][1]} (ID: {x})",
+        # A new key per page and filter set so a stale selection is never reused
+        key=f"{key}_project_{len(cursors)}_{status}_{project_type}"
+    )
+    
+    total = db.count_projects(**filters)
+    page_count = max(1, -(-total // db.PAGE_SIZE))
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if len(cursors) > 1 and st.button("Previous", key=f"{key}_previous"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)} of {page_count} ({total} projects)")
+    with col3:
+        if next_cursor and st.button("Next", key=f"{key}_next"):
+            cursors.append(next_cursor)
+            st.rerun()
+    
+    return project_rows[selected_project_id]
+
 def login_page():
     st.title("Impact Calculator Login")
     
@@ -94,7 +176,7 @@ def customer_dashboard():
             title = st.text_input("Project Title")
             project_type = st.selectbox(
                 "Project Type",
-                options=["New Development", "Enhancement", "Maintenance", "Support"]
+                options=PROJECT_TYPES
             )
             description = st.text_area("Project Description")
         
@@ -201,54 +283,86 @@ def customer_dashboard():
     st.markdown("""
         <div class="section-header">Your Projects</div>
     """, unsafe_allow_html=True)
+    customer_projects_section(st.session_state.user[0])
+
+def customer_project_details(project_id, summary):
+    """Details of one customer project, loaded when its expander is opened"""
+    project = db.get_project(project_id)
+    inputs = db.get_project_inputs(project_id)
     
-    projects = db.get_user_projects(st.session_state.user[0])
-    for project in projects:
-        with st.expander(f"{project[1]} - {project[4]} ({project[3]})"):
-            inputs = db.get_project_inputs(project[0])
-            if not inputs:
-                inputs = {}
-            
-            # Display project details
-            st.write(f"**Description:** {project[2]}")
-            st.write(f"**Core Functionality:** {inputs.get('core_functionality', 'Not specified')}")
-            st.write(f"**Status:** {project[4]}")
-            
-            # Benefits
-            st.subheader("Benefits")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.write(f"Expected Revenue: ${float(inputs.get('expected_revenue', 0)):,.2f}")
-            with col2:
-                st.write(f"Time Savings: {float(inputs.get('time_savings', 0)):.1f} hours/month")
-            with col3:
-                st.write(f"Efficiency Improvement: {float(inputs.get('efficiency_improvement', 0)):.1f}%")
-            
-            if inputs.get('customer_comments'):
-                st.subheader("Comments")
-                st.write(inputs['customer_comments'])
-            
-            if project[6]:  # PM estimate
-                st.write(f"PM Estimate: ${float(project[6]):,.2f}")
-            if project[7]:  # IT Director estimate
-                st.write(f"IT Director Estimate: ${float(project[7]):,.2f}")
+    # Display project details
+    st.write(f"**Description:** {project[2] if project else ''}")
+    st.write(f"**Core Functionality:** {inputs.get('core_functionality', 'Not specified')}")
+    st.write(f"**Status:** {summary[2]}")
+    
+    # Benefits
+    st.subheader("Benefits")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.write(f"Expected Revenue: ${float(inputs.get('expected_revenue', 0)):,.2f}")
+    with col2:
+        st.write(f"Time Savings: {float(inputs.get('time_savings', 0)):.1f} hours/month")
+    with col3:
+        st.write(f"Efficiency Improvement: {float(inputs.get('efficiency_improvement', 0)):.1f}%")
+    
+    if inputs.get('customer_comments'):
+        st.subheader("Comments")
+        st.write(inputs['customer_comments'])
+    
+    if summary[4]:  # PM estimate
+        st.write(f"PM Estimate: ${float(summary[4]):,.2f}")
+    if summary[5]:  # IT Director estimate
+        st.write(f"IT Director Estimate: ${float(summary[5]):,.2f}")
+
+@st.fragment
+@instrumentation.track_fragment
+def customer_projects_section(customer_id):
+    """
+    One page of the customer's projects. Collapsed rows only need the summary query;
+    a project's description and inputs are loaded when its expander is opened.
+    """
+    # Keep the cursor of every visited page so "Previous" can go back
+    cursors = st.session_state.setdefault('customer_project_pages', [None])
+    summaries, next_cursor = db.list_project_summaries(customer_id, after=cursors[-1],
+                                                       limit=CUSTOMER_PROJECTS_PER_PAGE)
+    if not summaries:
+        st.info("You have not submitted any projects yet")
+        return
+    
+    for summary in summaries:
+        project_id = summary[0]
+        # Opening or closing an expander reruns this fragment, so closed ones stay empty
+        expander = st.expander(f"{summary[1]} - {summary[2]} ({summary[3]})",
+                               key=f"customer_project_{project_id}", on_change="rerun")
+        with expander:
+            if expander.open:
+                customer_project_details(project_id, summary)
+    
+    total = db.count_projects(customer_id=customer_id)
+    page_count = max(1, -(-total // CUSTOMER_PROJECTS_PER_PAGE))
+    col1, col2, col3 = st.columns([1, 2, 1])
+    # The buttons move the cursor in their callbacks, before the fragment reruns
+    with col1:
+        if len(cursors) > 1:
+            st.button("Previous", key="customer_projects_previous", on_click=cursors.pop)
+    with col2:
+        st.caption(f"Page {len(cursors)} of {page_count} ({total} projects)")
+    with col3:
+        if next_cursor:
+            st.button("Next", key="customer_projects_next", on_click=cursors.append, args=(next_cursor,))
 
 def pm_dashboard():
     st.markdown("""
         <div class="section-header">Project Manager Dashboard</div>
     """, unsafe_allow_html=True)
     
-    # Get all projects
-    projects = db.get_all_projects()
+    # Project selection
+    selected_project = project_picker("pm")
     
-    if not projects:
+    if not selected_project:
         st.warning("No projects found in the database")
         return
-    
-    # Project selection
-    project_options = {f"{p[1]} (ID: {p[0]})": p[0] for p in projects}
-    selected_project = st.selectbox("Select Project", options=list(project_options.keys()))
-    project_id = project_options[selected_project]
+    project_id = selected_project[0]
     
     # Get project data
     project_data = db.get_project(project_id)
@@ -302,13 +416,15 @@ def pm_dashboard():
         col1, col2 = st.columns(2)
         with col1:
             project_duration = st.number_input("Project Duration (months)", 
-                                             value=float(inputs.get('project_duration', 1)),
+                                             value=min(float(inputs.get('project_duration', 1)), float(cashflow.MAX_PROJECT_DURATION_MONTHS)),
                                              min_value=1.0,
+                                             max_value=float(cashflow.MAX_PROJECT_DURATION_MONTHS),
                                              help="How long will the project take to complete?")
         with col2:
             maintenance_period = st.number_input("Maintenance Period (months)", 
-                                               value=float(inputs.get('maintenance_period', 0)),
+                                               value=min(float(inputs.get('maintenance_period', 0)), float(cashflow.MAX_MAINTENANCE_MONTHS)),
                                                min_value=0.0,
+                                               max_value=float(cashflow.MAX_MAINTENANCE_MONTHS),
                                                help="How long will the project need maintenance support?")
         
         # Additional costs
@@ -337,11 +453,6 @@ def pm_dashboard():
                                  help="Add any comments or notes about the project")
         
         if st.form_submit_button("Save Changes"):
-            # Calculate total cost based on role hours (assuming average hourly rate of $100)
-            total_hours = sum(float(hours) for hours in role_hours.values())
-            labor_cost = total_hours * 100
-            total_cost = labor_cost + infrastructure_cost + software_licenses + training_cost
-            
             # Update project inputs
             inputs.update({
                 'role_hours': role_hours,
@@ -350,10 +461,14 @@ def pm_dashboard():
                 'infrastructure_cost': infrastructure_cost,
                 'software_licenses': software_licenses,
                 'training_cost': training_cost,
-                'pm_comments': pm_comments,
-                'total_cost': total_cost
+                'pm_comments': pm_comments
             })
             
+            # Total cost from the rate card and cost formula of this project type
+            project_rates = rates.rate_card().rates_for(project_data[3])
+            project_formulas = formulas.formula_registry().for_type(project_data[3])
+            inputs['total_cost'] = roi.compute_roi(inputs, project_rates, project_formulas)['total_costs']
+            
             db.save_project_inputs(project_id, inputs)
             db.update_project_status(project_id, 'estimated_by_pm')
             st.success("Project inputs updated successfully!")
@@ -375,22 +490,283 @@ def pm_dashboard():
         st.subheader("Customer Comments")
         st.write(inputs['customer_comments'])
 
+@st.fragment
+@instrumentation.track_fragment
+def it_comments_section(project_id):
+    """Comments and approval of a project on the IT Director dashboard"""
+    inputs = db.get_project_inputs(project_id)
+    project_data = db.get_project(project_id)
+    
+    st.subheader("Comments")
+    
+    # Display existing comments
+    if inputs and inputs.get('customer_comments'):
+        st.write("**Customer Comments:**")
+        st.write(inputs['customer_comments'])
+    
+    if inputs and inputs.get('pm_comments'):
+        st.write("**Project Manager Comments:**")
+        st.write(inputs['pm_comments'])
+    
+    if inputs and inputs.get('it_comments'):
+        st.write("**IT Director Comments:**")
+        st.write(inputs['it_comments'])
+    
+    # Add IT Director comments
+    with st.form("add_it_comment"):
+        comment = st.text_area("Add your comment")
+        if st.form_submit_button("Submit Comment"):
+            if comment:
+                inputs['it_comments'] = comment
+                db.save_project_inputs(project_id, inputs)
+                st.success("Comment added successfully!")
+                # Only the comments change; the rest of the page stays as it is
+                st.rerun(scope="fragment")
+    
+    # Approve button
+    if project_data[4] != 'approved_by_it':
+        if st.button("Approve Project", type="primary"):
+            db.update_project_status(project_id, 'approved_by_it')
+            st.success("Project approved successfully!")
+            st.rerun()
+
+@st.fragment
+@instrumentation.track_fragment
+def risk_simulation_section(project_id, project_type):
+    """Monte Carlo simulation of a project's ROI under uncertain inputs"""
+    inputs = db.get_project_inputs(project_id)
+    
+    st.subheader("Risk Simulation")
+    if inputs:
+        with st.form("risk_simulation"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                spread = st.slider("Input uncertainty (±%)", 0, 100, 20)
+            with col2:
+                kind = st.selectbox("Distribution", SIMULATION_DISTRIBUTIONS)
+            with col3:
+                scenarios = st.select_slider("Scenarios", options=SIMULATION_SCENARIOS, value=100_000)
+            if st.form_submit_button("Run Simulation"):
+                distributions = simulation.default_distributions(inputs, spread / 100, kind)
+                project_rates = rates.rate_card().rates_for(project_type)
+                project_formulas = formulas.formula_registry().for_type(project_type)
+                result = simulation.simulate_roi(inputs, distributions, scenarios, rates=project_rates,
+                                                 formulas=project_formulas)
+                st.session_state.simulation_result = (project_id, result)
+        
+        simulated = st.session_state.get('simulation_result')
+        if simulated and simulated[0] == project_id:
+            result = simulated[1]
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("P5 ROI", f"{result['percentiles'][5]:.1f}%")
+            with col2:
+                st.metric("Median ROI", f"{result['percentiles'][50]:.1f}%")
+            with col3:
+                st.metric("P95 ROI", f"{result['percentiles'][95]:.1f}%")
+            with col4:
+                st.metric("Chance of Loss", f"{result['probability_of_loss']:.1%}")
+            st.plotly_chart(utils.create_roi_distribution_chart(result))
+    else:
+        st.info("This project has no inputs to simulate yet.")
+
+@st.fragment
+@instrumentation.track_fragment
+def rate_card_section():
+    """Hourly rates used for labor costs"""
+    st.subheader("Rate Card")
+    with st.expander("Rates"):
+        st.dataframe([
+            {
+                'Role': role,
+                'Project Type': project_type or 'All types',
+                'Hourly Rate': hourly_rate,
+                'Effective From': effective_from
+            }
+            for _, role, project_type, hourly_rate, effective_from in db.get_rates()
+        ], hide_index=True)
+    
+    with st.form("set_rate"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            rate_role = st.selectbox("Role", roi.ROLES)
+        with col2:
+            rate_type = st.selectbox("Project Type", ["All types"] + PROJECT_TYPES)
+        with col3:
+            hourly_rate = st.number_input("Hourly Rate ($)", min_value=0.0, value=float(roi.DEFAULT_RATE), step=5.0)
+        with col4:
+            effective_from = st.date_input("Effective From", value=date.today())
+        if st.form_submit_button("Save Rate"):
+            recost = db.save_rate(rate_role, hourly_rate, effective_from.isoformat(),
+                                  None if rate_type == "All types" else rate_type)
+            if recost:
+                st.success("Rate saved; all projects will be recalculated in the background")
+            else:
+                st.success(f"Rate saved; it takes effect on {effective_from:%Y-%m-%d}")
+
+@st.fragment
+@instrumentation.track_fragment
+def formulas_section():
+    """Benefit and cost formulas of the ROI model"""
+    st.subheader("Formulas")
+    registry = formulas.formula_registry()
+    with st.expander("Formulas in use"):
+        st.dataframe([
+            {
+                'Formula': name,
+                'Project Type': project_type or 'All types',
+                'Expression': expression
+            }
+            for project_type in [None] + PROJECT_TYPES
+            for name, expression in registry.for_type(project_type).expressions.items()
+            if project_type is None or name in registry.overrides.get(project_type, {})
+        ], hide_index=True)
+    
+    with st.form("set_formula"):
+        col1, col2 = st.columns(2)
+        with col1:
+            formula_name = st.selectbox("Formula", list(registry.default.expressions))
+        with col2:
+            formula_type = st.selectbox("Project Type", ["All types"] + PROJECT_TYPES, key="formula_type")
+        expression = st.text_input("Expression", help="Use inputs, labor_cost and other formulas with + - * / **, "
+                                                      "'a if condition else b', min, max and abs")
+        if st.form_submit_button("Save Formula"):
+            formula_type = None if formula_type == "All types" else formula_type
+            try:
+                formulas.check_formula(formula_name, expression, formula_type)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                db.save_formula(formula_name, expression, formula_type)
+                st.success("Formula saved; all projects will be recalculated in the background")
+    
+    stored = db.get_formulas()
+    if stored:
+        with st.form("revert_formula"):
+            formula_id, formula_name, formula_type, _ = st.selectbox(
+                "Stored Formula", stored,
+                format_func=lambda row: f"{row[1]} ({row[2] or 'All types'}): {row[3]}")
+            if st.form_submit_button("Revert Formula"):
+                try:
+                    formulas.check_formula_removal(formula_name, formula_type or None)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    db.delete_formula(formula_id)
+                    st.success("Formula reverted; all projects will be recalculated in the background")
+
+@st.fragment
+@instrumentation.track_fragment
+def roi_recalculation_section():
+    """Progress of the background ROI recalculation"""
+    st.subheader("ROI Recalculation")
+    progress = db.get_roi_job_progress()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Pending", progress.get('pending', 0))
+    with col2:
+        st.metric("Running", progress.get('running', 0))
+    with col3:
+        st.metric("Done", progress.get('done', 0))
+    with col4:
+        st.metric("Failed", progress.get('failed', 0))
+    recost = db.get_recost_status()
+    if recost:
+        finished = f", finished {recost['finished_at']}" if recost['finished_at'] else ""
+        st.caption(f"Bulk re-cost of all projects: {recost['status']} (requested {recost['enqueued_at']}{finished})")
+        if recost['error']:
+            st.error(f"Bulk re-cost failed: {recost['error']}")
+    
+    if st.button("Recalculate All Projects"):
+        queued = db.enqueue_all_roi_jobs()
+        st.success(f"Queued {queued} projects for recalculation")
+
+@st.fragment
+@instrumentation.track_fragment
+def portfolio_section():
+    """Portfolio overview, calculated for every project in one batch"""
+    st.subheader("Portfolio ROI")
+    if st.checkbox("Show portfolio ROI"):
+        portfolio_data = portfolio.portfolio_roi()
+        rank_by = st.selectbox("Rank by", PORTFOLIO_RANKINGS, format_func=str.upper)
+        st.dataframe(
+            portfolio_data.sort_values(rank_by, ascending=False).head(PORTFOLIO_ROWS),
+            hide_index=True
+        )
+        st.download_button(
+            "Export Portfolio (CSV)",
+            portfolio_data.to_csv(index=False),
+            file_name="portfolio_roi.csv",
+            mime="text/csv"
+        )
+
+@st.fragment
+@instrumentation.track_fragment
+def timeline_section():
+    """When projects were submitted, by type and status"""
+    st.subheader("Project Timeline")
+    if st.checkbox("Show project timeline"):
+        timeline = db.get_project_timeline(utils.TIMELINE_MAX_POINTS)
+        st.plotly_chart(utils.create_project_timeline(timeline))
+
+@st.fragment
+@instrumentation.track_fragment
+def portfolio_optimizer_section():
+    """Budget-constrained selection among the projects estimated by a PM"""
+    st.subheader("Portfolio Optimizer")
+    with st.form("portfolio_optimizer"):
+        col1, col2 = st.columns(2)
+        with col1:
+            budget = st.number_input("Budget ($)", min_value=0.0, value=1000000.0, step=10000.0)
+        with col2:
+            objective = st.selectbox("Maximize", list(OPTIMIZER_OBJECTIVES), format_func=OPTIMIZER_OBJECTIVES.get)
+        with st.expander("Role capacity limits (hours, 0 for no limit)"):
+            capacity = {}
+            for role in roi.ROLES:
+                hours = st.number_input(role, min_value=0.0, value=0.0, step=10.0, key=f"capacity_{role}")
+                if hours > 0:
+                    capacity[role] = hours
+        if st.form_submit_button("Optimize"):
+            st.session_state.optimizer_result = portfolio.optimize_portfolio(budget, objective, capacity)
+    
+    optimized = st.session_state.get('optimizer_result')
+    if optimized:
+        candidates, method = optimized
+        chosen = candidates[candidates['selected']]
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Selected Projects", f"{len(chosen)} of {len(candidates)}")
+        with col2:
+            st.metric("Total Cost", f"${chosen['total_costs'].sum():,.2f}")
+        with col3:
+            st.metric("Total Benefits", f"${chosen['total_benefits'].sum():,.2f}")
+        with col4:
+            st.metric("Total NPV", f"${chosen['npv'].sum():,.2f}")
+        st.caption(f"Solver: {method}")
+        st.dataframe(
+            chosen[['id', 'title', 'project_type', 'total_costs', 'total_benefits', 'npv', 'roi']],
+            hide_index=True
+        )
+        
+        if len(chosen) and st.button("Approve Selected Projects", type="primary"):
+            for selected_id in chosen['id']:
+                db.update_project_status(int(selected_id), 'approved_by_it')
+            del st.session_state.optimizer_result
+            st.success(f"Approved {len(chosen)} projects!")
+            st.rerun()
+
 def it_director_dashboard():
     st.markdown("""
         <div class="section-header">IT Director Dashboard</div>
     """, unsafe_allow_html=True)
     
-    # Get all projects
-    projects = db.get_all_projects()
+    # Project selection
+    selected_project = project_picker("it_director")
     
-    if not projects:
+    if not selected_project:
         st.warning("No projects found in the database")
         return
-    
-    # Project selection
-    project_options = {f"{p[1]} (ID: {p[0]})": p[0] for p in projects}
-    selected_project = st.selectbox("Select Project", options=list(project_options.keys()))
-    project_id = project_options[selected_project]
+    project_id = selected_project[0]
     
     # Get project data
     project_data = db.get_project(project_id)
@@ -469,179 +845,143 @@ def it_director_dashboard():
         for cost, value in costs_data.items():
             st.metric(cost, f"${value:,.2f}")
     
-    # Comments section
-    st.subheader("Comments")
-    
-    # Display existing comments
-    if inputs and inputs.get('customer_comments'):
-        st.write("**Customer Comments:**")
-        st.write(inputs['customer_comments'])
+    # The sections below rerun on their own when their widgets are used
+    it_comments_section(project_id)
+    risk_simulation_section(project_id, project_data[3])
+    rate_card_section()
+    formulas_section()
+    roi_recalculation_section()
+    portfolio_section()
+    timeline_section()
+    portfolio_optimizer_section()
+
+def calculate_roi(project_id):
+    """
+    Get the ROI of a project from the project_roi table.
+    The result is only recalculated and stored when the project's inputs changed since it was saved.
+    """
+    try:
+        return worker.refresh_project_roi(project_id)
+    except Exception as e:
+        logger.error("Error calculating ROI: %s", e)
+        return roi.empty_roi()
+
+@st.fragment
+@instrumentation.track_fragment
+def sensitivity_section(project_id, project_type):
+    """Tornado chart and two-way analysis of a project's ROI"""
+    inputs = db.get_project_inputs(project_id)
+    project_rates = rates.rate_card().rates_for(project_type)
+    project_formulas = formulas.formula_registry().for_type(project_type)
     
-    if inputs and inputs.get('pm_comments'):
-        st.write("**Project Manager Comments:**")
-        st.write(inputs['pm_comments'])
+    st.markdown("""
+        <div class="project-section">
+            <div class="section-header">Sensitivity Analysis</div>
+    """, unsafe_allow_html=True)
     
-    if inputs and inputs.get('it_comments'):
-        st.write("**IT Director Comments:**")
-        st.write(inputs['it_comments'])
+    # Only inputs the ROI formulas use can move the ROI
+    input_labels = sensitivity.sensitivity_inputs('roi', project_formulas)
+    delta = st.slider("Change each input by (±%)", 5, 100, 20, step=5, key="tornado_delta")
+    tornado = sensitivity.tornado(inputs, dict.fromkeys(input_labels, delta / 100),
+                                  rates=project_rates, formulas=project_formulas)
+    st.plotly_chart(utils.create_tornado_chart(tornado))
     
-    # Add IT Director comments
-    with st.form("add_it_comment"):
-        comment = st.text_area("Add your comment")
-        if st.form_submit_button("Submit Comment"):
-            if comment:
-                inputs['it_comments'] = comment
-                db.save_project_inputs(project_id, inputs)
-                st.success("Comment added successfully!")
-                st.rerun()
+    with st.expander("Two-way analysis"):
+        input_keys = list(input_labels)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            x_key = st.selectbox("First input", input_keys,
+                                 index=input_keys.index('expected_revenue') if 'expected_revenue' in input_keys else 0,
+                                 format_func=input_labels.get)
+        with col2:
+            # The same input on both axes would be scaled twice
+            y_keys = [key for key in input_keys if key != x_key]
+            y_key = st.selectbox("Second input", y_keys,
+                                 index=y_keys.index(sensitivity.LABOR_HOURS) if sensitivity.LABOR_HOURS in y_keys else 0,
+                                 format_func=input_labels.get)
+        with col3:
+            grid_range = st.slider("Range (±%)", 5, 100, 20, step=5, key="grid_range")
+        factors = sensitivity.grid_factors(grid_range / 100)
+        grid = sensitivity.grid(inputs, x_key, y_key, factors, factors, rates=project_rates,
+                                formulas=project_formulas)
+        st.plotly_chart(utils.create_sensitivity_heatmap(
+            grid, input_labels[x_key], input_labels[y_key]
+        ))
     
-    # Approve button
-    if project_data[4] != 'approved_by_it':
-        if st.button("Approve Project", type="primary"):
-            db.update_project_status(project_id, 'approved_by_it')
-            st.success("Project approved successfully!")
-            st.rerun()
+    st.markdown("</div>", unsafe_allow_html=True)
 
-def calculate_roi(project_id):
-    try:
-        # Get project data and inputs
-        project_data = db.get_project(project_id)
-        inputs = db.get_project_inputs(project_id)
-        
-        print(f"\n=== Calculating ROI for project {project_id} ===")
-        print(f"Project data: {project_data}")
-        print(f"Project inputs: {inputs}")
-        
-        # Calculate benefits
-        expected_revenue = float(inputs.get('expected_revenue', 0))
-        time_savings = float(inputs.get('time_savings', 0))
-        efficiency_improvement_percent = float(inputs.get('efficiency_improvement', 0))
-        
-        # Convert efficiency improvement percentage to monetary value
-        # Assuming efficiency improvement affects 20% of annual revenue
-        project_duration = float(inputs.get('project_duration', 1))
-        annual_revenue = expected_revenue / (project_duration / 12)
-        efficiency_improvement = (annual_revenue * 0.2 * efficiency_improvement_percent / 100) * (project_duration / 12)
-        
-        print(f"Benefits calculation:")
-        print(f"Expected Revenue: ${expected_revenue:,.2f}")
-        print(f"Time Savings: ${time_savings:,.2f}")
-        print(f"Efficiency Improvement: {efficiency_improvement_percent:.1f}% (${efficiency_improvement:,.2f})")
-        
-        # Calculate costs
-        # Calculate labor costs based on role hours and rates
-        role_hours = inputs.get('role_hours', {})
-        total_labor_cost = 0
-        
-        # Standard hourly rates if not specified
-        standard_rates = {
-            'Business Analyst': 100,
-            'Project Manager': 150,
-            'UI/UX Designer': 120,
-            'Frontend Developer': 120,
-            'Backend Developer': 120,
-            'DevOps Engineer': 130,
-            'QA Engineer': 100,
-            'Data Engineer': 130,
-            'Security Engineer': 140,
-            'Technical Lead': 160
-        }
-        
-        for role, hours in role_hours.items():
-            if hours > 0:
-                rate = standard_rates.get(role, 120)  # Default rate if role not found
-                total_labor_cost += float(hours) * rate
-        
-        # Additional costs
-        infrastructure_cost = float(inputs.get('infrastructure_cost', 0))
-        software_licenses = float(inputs.get('software_licenses', 0))
-        training_cost = float(inputs.get('training_cost', 0))
-        
-        print(f"Costs calculation:")
-        print(f"Labor Cost: ${total_labor_cost:,.2f}")
-        print(f"Infrastructure: ${infrastructure_cost:,.2f}")
-        print(f"Software: ${software_licenses:,.2f}")
-        print(f"Training: ${training_cost:,.2f}")
-        
-        # Calculate total benefits and costs
-        total_benefits = expected_revenue + time_savings + efficiency_improvement
-        total_costs = total_labor_cost + infrastructure_cost + software_licenses + training_cost
-        
-        print(f"Total benefits: ${total_benefits:,.2f}")
-        print(f"Total costs: ${total_costs:,.2f}")
-        
-        # Calculate ROI
-        roi = ((total_benefits - total_costs) / total_costs * 100) if total_costs > 0 else 0
-        print(f"ROI: {roi:.1f}%")
-        
-        # Update project inputs with calculated values
-        inputs.update({
-            'total_benefits': total_benefits,
-            'total_costs': total_costs,
-            'roi_percentage': roi,
-            'labor_costs': total_labor_cost,
-            'infrastructure_costs': infrastructure_cost,
-            'software_costs': software_licenses,
-            'training_costs': training_cost
-        })
-        
-        # Save updated inputs
-        db.save_project_inputs(project_id, inputs)
-        
-        return {
-            'total_benefits': total_benefits,
-            'total_costs': total_costs,
-            'roi': roi,
-            'benefits_breakdown': {
-                'expected_revenue': expected_revenue,
-                'time_savings': time_savings,
-                'efficiency_improvement': efficiency_improvement_percent
-            },
-            'costs_breakdown': {
-                'labor': total_labor_cost,
-                'infrastructure': infrastructure_cost,
-                'software': software_licenses,
-                'training': training_cost
-            }
-        }
-    except Exception as e:
-        print(f"Error calculating ROI: {str(e)}")
-        return {
-            'total_benefits': 0,
-            'total_costs': 0,
-            'roi': 0,
-            'benefits_breakdown': {
-                'expected_revenue': 0,
-                'time_savings': 0,
-                'efficiency_improvement': 0
-            },
-            'costs_breakdown': {
-                'labor': 0,
-                'infrastructure': 0,
-                'software': 0,
-                'training': 0
-            }
-        }
+@st.fragment
+@instrumentation.track_fragment
+def what_if_section(project_id, project_type):
+    """What-if scenarios of a project; they are calculated in memory and never saved"""
+    inputs = db.get_project_inputs(project_id)
+    project_rates = rates.rate_card().rates_for(project_type)
+    project_formulas = formulas.formula_registry().for_type(project_type)
+    
+    st.markdown("""
+        <div class="project-section">
+            <div class="section-header">What-If Analysis</div>
+    """, unsafe_allow_html=True)
+    
+    base_revenue = float(inputs.get('expected_revenue', 0))
+    base_duration = min(max(1, int(round(float(inputs.get('project_duration', 1))))), cashflow.MAX_PROJECT_DURATION_MONTHS)
+    role_hours = inputs.get('role_hours') or {}
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        max_revenue = max(2 * base_revenue, 10000.0)
+        revenue = st.slider("Expected Revenue ($)", 0.0, max_revenue, base_revenue, step=max_revenue / 200,
+                            key=f"whatif_revenue_{project_id}")
+        duration = st.slider("Project Duration (months)", 1, min(max(36, 2 * base_duration), cashflow.MAX_PROJECT_DURATION_MONTHS),
+                             base_duration,
+                             key=f"whatif_duration_{project_id}")
+    with col2:
+        hours_percent = st.slider("Labor Hours (% of estimate)", 0, 200, 100, step=5,
+                                  key=f"whatif_hours_{project_id}")
+        rates_percent = st.slider("Hourly Rates (% of rate card)", 50, 200, 100, step=5,
+                                  key=f"whatif_rates_{project_id}")
+    
+    scenario_inputs = dict(
+        inputs,
+        expected_revenue=revenue,
+        project_duration=duration,
+        role_hours={role: float(hours) * hours_percent / 100 for role, hours in role_hours.items()}
+    )
+    scenario_rates = {role: project_rates.get(role, roi.DEFAULT_RATE) * rates_percent / 100 for role in role_hours}
+    # The scenario's ROI graph is kept between slider moves, so each move recalculates
+    # only the formulas that depend on the slider
+    graph_key = f"whatif_graph_{project_id}"
+    graph = st.session_state.get(graph_key)
+    if graph is None or graph.formulas is not project_formulas:
+        graph = st.session_state[graph_key] = roi.RoiGraph(scenario_inputs, scenario_rates, project_formulas)
+    baseline = whatif.what_if(inputs, project_rates, project_formulas)
+    scenario = whatif.what_if(scenario_inputs, scenario_rates, project_formulas, graph)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Scenario ROI", f"{scenario['roi']:.1f}%", f"{scenario['roi'] - baseline['roi']:+.1f} pts")
+    with col2:
+        st.metric("Scenario NPV", f"${scenario['npv']:,.0f}", f"{scenario['npv'] - baseline['npv']:+,.0f}")
+    with col3:
+        payback = scenario['payback_month']
+        st.metric("Scenario Payback", f"Month {payback:.0f}" if payback is not None else "Not reached")
+    st.plotly_chart(utils.create_cumulative_cash_flow_chart(scenario['cash_flows'], baseline['cash_flows']))
+    
+    st.markdown("</div>", unsafe_allow_html=True)
 
 def roi_calculator():
     st.markdown("""
         <div class="section-header">ROI Calculator</div>
     """, unsafe_allow_html=True)
     
-    # Get all projects
-    projects = db.get_all_projects()
-    
     # Project selection
-    project_titles = {p[0]: p[1] for p in projects}
-    selected_project_id = st.selectbox(
-        "Select Project",
-        options=list(project_titles.keys()),
-        format_func=lambda x: project_titles[x]
-    )
+    project = project_picker("roi_calculator")
     
-    if selected_project_id:
-        project = next(p for p in projects if p[0] == selected_project_id)
+    if project:
+        selected_project_id = project[0]
         inputs = db.get_project_inputs(selected_project_id)
+        project_rates = rates.rate_card().rates_for(project[3])
+        project_formulas = formulas.formula_registry().for_type(project[3])
         
         # Calculate ROI
         roi_data = calculate_roi(selected_project_id)
@@ -905,8 +1245,42 @@ def roi_calculator():
                 </div>
             """, unsafe_allow_html=True)
         
+        # Time-phased metrics from the monthly cash flows
+        cash_flow = cashflow.project_cash_flow(inputs, rates=project_rates, formulas=project_formulas)
+        irr_text = f"{cash_flow['irr'] * 100:.1f}%" if cash_flow['irr'] is not None else "n/a"
+        payback_text = f"Month {cash_flow['payback_month']:.0f}" if cash_flow['payback_month'] is not None else "Not reached"
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown(f"""
+                <div class="metric-card">
+                    <div class="metric-label">NPV ({cashflow.DISCOUNT_RATE:.0%} discount rate)</div>
+                    <div class="metric-value">${cash_flow['npv']:,.2f}</div>
+                </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown(f"""
+                <div class="metric-card">
+                    <div class="metric-label">IRR</div>
+                    <div class="metric-value">{irr_text}</div>
+                </div>
+            """, unsafe_allow_html=True)
+        
+        with col3:
+            st.markdown(f"""
+                <div class="metric-card">
+                    <div class="metric-label">Payback</div>
+                    <div class="metric-value">{payback_text}</div>
+                </div>
+            """, unsafe_allow_html=True)
+        
         st.markdown("</div></div>", unsafe_allow_html=True)
         
+        # Interactive sections rerun on their own when their widgets change
+        sensitivity_section(selected_project_id, project[3])
+        what_if_section(selected_project_id, project[3])
+        
         # Comments Section
         st.markdown("""
             <div class="project-section">
@@ -941,6 +1315,59 @@ def roi_calculator():
         
         st.markdown("</div></div>", unsafe_allow_html=True)
 
+def query_stats_page():
+    st.markdown("""
+        <div class="section-header">Query Statistics</div>
+    """, unsafe_allow_html=True)
+    
+    # Shared read cache
+    cache = db.cache_stats()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Cache Hits", cache['hits'])
+    with col2:
+        st.metric("Cache Misses", cache['misses'])
+    with col3:
+        st.metric("Cached Entries", cache['entries'])
+    
+    # Slowest queries
+    st.subheader("Slowest Queries")
+    bucket_labels = [f"<={bound}ms" for bound in instrumentation.HISTOGRAM_BOUNDS_MS]
+    bucket_labels.append(f">{instrumentation.HISTOGRAM_BOUNDS_MS[-1]}ms")
+    queries = instrumentation.slowest_queries()
+    if queries:
+        st.table([{
+            'Function': q['function'],
+            'Calls': q['calls'],
+            'Rows': q['rows'],
+            'Avg (ms)': f"{q['total_ms'] / q['calls']:.2f}",
+            'Max (ms)': f"{q['max_ms']:.2f}",
+            'Latency': ', '.join(f"{label}: {count}" for label, count in zip(bucket_labels, q['histogram']) if count),
+            'Top Call Site': max(q['call_sites'], key=q['call_sites'].get),
+            'Query': q['sql'][:120]
+        } for q in queries])
+    else:
+        st.info("No queries recorded yet")
+    
+    # Query counts per page render
+    st.subheader("Queries per Page Render")
+    st.caption("Sections that rerun on their own are listed as \"<section> (fragment)\" for those reruns; "
+               "in a full page render their queries count towards the page.")
+    renders = instrumentation.render_stats()
+    if renders:
+        st.table([{
+            'Page': r['page'],
+            'Renders': r['renders'],
+            'Avg Queries': f"{r['queries'] / r['renders']:.1f}",
+            'Last Render Queries': r['last_queries'],
+            'Avg Query Time (ms)': f"{r['query_ms'] / r['renders']:.2f}",
+            'Avg Render Time (ms)': f"{r['render_ms'] / r['renders']:.2f}"
+        } for r in renders])
+    
+    if st.button("Reset Statistics"):
+        instrumentation.reset()
+        st.rerun()
+
 def existing_projects():
     st.title("Existing Projects")
     
@@ -1019,11 +1446,13 @@ def existing_projects():
         # Timeline
         st.write("**Timeline**")
         project_duration = st.number_input("Project Duration (months)", 
-                                         value=float(existing_inputs.get('project_duration', 1)),
-                                         min_value=1.0)
+                                         value=min(float(existing_inputs.get('project_duration', 1)), float(cashflow.MAX_PROJECT_DURATION_MONTHS)),
+                                         min_value=1.0,
+                                         max_value=float(cashflow.MAX_PROJECT_DURATION_MONTHS))
         maintenance_period = st.number_input("Maintenance Period (months)", 
-                                           value=float(existing_inputs.get('maintenance_period', 0)),
-                                           min_value=0.0)
+                                           value=min(float(existing_inputs.get('maintenance_period', 0)), float(cashflow.MAX_MAINTENANCE_MONTHS)),
+                                           min_value=0.0,
+                                           max_value=float(cashflow.MAX_MAINTENANCE_MONTHS))
         
         submitted = st.form_submit_button("Save Inputs")
         
@@ -1128,11 +1557,13 @@ def enhancements():
         # Timeline
         st.write("**Timeline**")
         project_duration = st.number_input("Project Duration (months)", 
-                                         value=float(existing_inputs.get('project_duration', 1)),
-                                         min_value=1.0)
+                                         value=min(float(existing_inputs.get('project_duration', 1)), float(cashflow.MAX_PROJECT_DURATION_MONTHS)),
+                                         min_value=1.0,
+                                         max_value=float(cashflow.MAX_PROJECT_DURATION_MONTHS))
         maintenance_period = st.number_input("Maintenance Period (months)", 
-                                           value=float(existing_inputs.get('maintenance_period', 0)),
-                                           min_value=0.0)
+                                           value=min(float(existing_inputs.get('maintenance_period', 0)), float(cashflow.MAX_MAINTENANCE_MONTHS)),
+                                           min_value=0.0,
+                                           max_value=float(cashflow.MAX_MAINTENANCE_MONTHS))
         
         submitted = st.form_submit_button("Save Enhancement Inputs")
         
@@ -1160,403 +1591,9 @@ def enhancements():
             st.rerun()
 
 def main():
-    # Light Theme
-    st.markdown("""
-        <style>
-        :root {
-            --primary-color: #2196F3;
-            --secondary-color: #64B5F6;
-            --accent-color: #90CAF9;
-            --text-color: #333333;
-            --light-gray: #F5F5F5;
-            --border-color: #E0E0E0;
-            --success-color: #4CAF50;
-            --warning-color: #FFA726;
-            --error-color: #F44336;
-            --card-bg: #FFFFFF;
-            --sidebar-bg: #FFFFFF;
-            --input-bg: #FFFFFF;
-            --hover-color: #F5F5F5;
-            --descartes-bg: #FFFFFF;
-            --descartes-border: #E0E0E0;
-            --descartes-hover: #F8F9FA;
-            --descartes-title: #2196F3;
-            --descartes-text: #333333;
-            --button-hover: #1976D2;
-        }
-        
-        .stApp {
-            background-color: var(--light-gray);
-            color: var(--text-color);
-        }
-        
-        .stButton>button {
-            background-color: var(--primary-color);
-            color: white;
-            border: none;
-            border-radius: 4px;
-            padding: 0.5rem 1rem;
-            font-weight: 500;
-            transition: all 0.2s ease;
-        }
-        
-        .stButton>button:hover {
-            background-color: var(--button-hover);
-            transform: translateY(-1px);
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            color: white;
-        }
-        
-        .stButton>button:focus {
-            outline: none;
-            box-shadow: 0 0 0 2px var(--accent-color);
-        }
-        
-        .stButton>button:active {
-            transform: translateY(0);
-            box-shadow: none;
-        }
-        
-        .stSelectbox>div>div>select {
-            border-color: var(--border-color);
-            background-color: var(--input-bg);
-            color: var(--text-color);
-        }
-        
-        .stTextInput>div>div>input {
-            border-color: var(--border-color);
-            background-color: var(--input-bg);
-            color: var(--text-color);
-        }
-        
-        .stNumberInput>div>div>input {
-            border-color: var(--border-color);
-            background-color: var(--input-bg);
-            color: var(--text-color);
-        }
-        
-        .stTextArea>div>div>textarea {
-            border-color: var(--border-color);
-            background-color: var(--input-bg);
-            color: var(--text-color);
-        }
-        
-        .stMarkdown h1 {
-            color: var(--primary-color);
-            font-weight: 600;
-        }
-        
-        .stMarkdown h2 {
-            color: var(--primary-color);
-            font-weight: 500;
-        }
-        
-        .stMarkdown h3 {
-            color: var(--text-color);
-            font-weight: 500;
-        }
-        
-        .metric-card {
-            background-color: var(--card-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            border: 1px solid var(--border-color);
-            margin-bottom: 1rem;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            transition: all 0.2s ease;
-        }
-        
-        .metric-card:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            border-color: var(--accent-color);
-            background-color: var(--hover-color);
-        }
-        
-        .metric-value {
-            color: var(--primary-color);
-            font-size: 1.5rem;
-            font-weight: 600;
-            margin-top: 0.5rem;
-        }
-        
-        .metric-label {
-            color: var(--text-color);
-            font-size: 0.9rem;
-            font-weight: 500;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
-        
-        .section-header {
-            color: var(--primary-color);
-            font-weight: 600;
-            margin-bottom: 1.5rem;
-            padding-bottom: 0.75rem;
-            border-bottom: 2px solid var(--primary-color);
-            font-size: 1.2rem;
-        }
-        
-        .status-badge {
-            padding: 0.5rem 1rem;
-            border-radius: 20px;
-            font-size: 0.85rem;
-            font-weight: 500;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
-        
-        .status-submitted {
-            background-color: var(--hover-color);
-            color: var(--primary-color);
-        }
-        
-        .status-estimated_by_pm {
-            background-color: #FFF8E1;
-            color: #F57F17;
-        }
-        
-        .status-estimated_by_it {
-            background-color: #FFF3E0;
-            color: var(--warning-color);
-        }
-        
-        .status-approved {
-            background-color: #E8F5E9;
-            color: var(--success-color);
-        }
-        
-        .status-rejected {
-            background-color: #FFEBEE;
-            color: var(--error-color);
-        }
-        
-        .project-section {
-            background-color: var(--card-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            margin-bottom: 1.5rem;
-            border: 1px solid var(--border-color);
-        }
-        
-        .project-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 1rem;
-            margin-top: 1rem;
-        }
-        
-        .project-card {
-            background-color: var(--card-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            border: 1px solid var(--border-color);
-        }
-        
-        .project-card:hover {
-            background-color: var(--hover-color);
-            border-color: var(--accent-color);
-        }
-        
-        .project-card-title {
-            color: var(--primary-color);
-            font-size: 1.1rem;
-            font-weight: 600;
-            margin-bottom: 0.75rem;
-        }
-        
-        .project-card-content {
-            color: var(--text-color);
-            font-size: 0.95rem;
-            line-height: 1.5;
-        }
-        
-        .comments-section {
-            background-color: var(--card-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            margin-top: 1rem;
-            border: 1px solid var(--border-color);
-        }
-        
-        .comments-section:hover {
-            background-color: var(--hover-color);
-            border-color: var(--accent-color);
-        }
-        
-        .comment-header {
-            color: var(--primary-color);
-            font-weight: 600;
-            margin-bottom: 0.5rem;
-        }
-        
-        .comment-content {
-            color: var(--text-color);
-            font-size: 0.95rem;
-            line-height: 1.5;
-        }
-        
-        .stSidebar {
-            background-color: var(--sidebar-bg);
-            border-right: 1px solid var(--border-color);
-        }
-        
-        .stSidebar .sidebar-content {
-            background-color: var(--sidebar-bg);
-        }
-        
-        .stSidebar .sidebar-content .block-container {
-            background-color: var(--sidebar-bg);
-        }
-        
-        .stSidebar .sidebar-content .block-container .element-container {
-            background-color: var(--sidebar-bg);
-        }
-        
-        .stSidebar .sidebar-content .block-container .element-container .stMarkdown {
-            background-color: var(--sidebar-bg);
-        }
-        
-        .stSidebar .sidebar-content .block-container .element-container .stMarkdown h1 {
-            color: var(--primary-color);
-        }
-        
-        .stSidebar .sidebar-content .block-container .element-container .stButton>button {
-            width: 100%;
-            margin-bottom: 0.5rem;
-        }
-        
-        .stSuccess {
-            background-color: #E8F5E9;
-            color: var(--success-color);
-            border: 1px solid var(--success-color);
-            border-radius: 4px;
-            padding: 1rem;
-            margin: 1rem 0;
-        }
-        
-        .stError {
-            background-color: #FFEBEE;
-            color: var(--error-color);
-            border: 1px solid var(--error-color);
-            border-radius: 4px;
-            padding: 1rem;
-            margin: 1rem 0;
-        }
-        
-        .stWarning {
-            background-color: #FFF3E0;
-            color: var(--warning-color);
-            border: 1px solid var(--warning-color);
-            border-radius: 4px;
-            padding: 1rem;
-            margin: 1rem 0;
-        }
-        
-        /* Descartes Square styles */
-        .descartes-square {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: 1rem;
-            margin: 1rem 0;
-        }
-        
-        .descartes-quadrant {
-            background-color: var(--descartes-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            border: 1px solid var(--descartes-border);
-            transition: all 0.2s ease;
-        }
-        
-        .descartes-quadrant:hover {
-            background-color: var(--descartes-hover);
-            border-color: var(--accent-color);
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        }
-        
-        .descartes-title {
-            color: var(--descartes-title);
-            font-size: 1.1rem;
-            font-weight: 600;
-            margin-bottom: 1rem;
-            padding-bottom: 0.5rem;
-            border-bottom: 2px solid var(--descartes-title);
-        }
-        
-        .descartes-content {
-            color: var(--descartes-text);
-            font-size: 0.95rem;
-            line-height: 1.6;
-        }
-        
-        /* Additional styles for better contrast */
-        .stSelectbox label, .stTextInput label, .stNumberInput label, .stTextArea label {
-            color: var(--text-color);
-        }
-        
-        .stExpander {
-            background-color: var(--card-bg);
-            border: 1px solid var(--border-color);
-            border-radius: 8px;
-            margin-bottom: 1rem;
-        }
-        
-        .stExpander:hover {
-            border-color: var(--accent-color);
-            background-color: var(--hover-color);
-        }
-        
-        .stExpander .streamlit-expanderHeader {
-            color: var(--primary-color);
-            font-weight: 500;
-        }
-        
-        .stExpander .streamlit-expanderContent {
-            background-color: var(--card-bg);
-        }
-        
-        /* Form styles */
-        .stForm {
-            background-color: var(--card-bg);
-            padding: 1.5rem;
-            border-radius: 8px;
-            border: 1px solid var(--border-color);
-        }
-        
-        .stForm:hover {
-            border-color: var(--accent-color);
-            background-color: var(--hover-color);
-        }
-        
-        /* Table styles */
-        .stTable {
-            background-color: var(--card-bg);
-            border: 1px solid var(--border-color);
-            border-radius: 8px;
-        }
-        
-        .stTable th {
-            background-color: var(--hover-color);
-            color: var(--primary-color);
-        }
-        
-        .stTable td {
-            color: var(--text-color);
-        }
-        
-        /* Slider styles */
-        .stSlider .stSlider > div > div > div {
-            background-color: var(--primary-color);
-        }
-        
-        .stSlider .stSlider > div > div > div:hover {
-            background-color: var(--secondary-color);
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    # Light theme; read once per process. Streamlit removes elements a rerun does not
+    # emit again, so the stylesheet is still sent on every run.
+    st.markdown(utils.theme_css(), unsafe_allow_html=True)
     
     # Add logo and header
     st.markdown("""
@@ -1568,22 +1605,25 @@ def main():
     if 'page' not in st.session_state:
         st.session_state.page = 'login'
     
-    if st.session_state.page == 'login':
-        login_page()
-    elif st.session_state.page == 'register':
-        register_page()
-    elif st.session_state.page == 'customer_dashboard':
-        customer_dashboard()
-    elif st.session_state.page == 'project_manager_dashboard':
-        pm_dashboard()
-    elif st.session_state.page == 'it_director_dashboard':
-        it_director_dashboard()
-    elif st.session_state.page == 'roi_calculator':
-        roi_calculator()
-    elif st.session_state.page == 'existing_projects':
-        existing_projects()
-    elif st.session_state.page == 'enhancements':
-        enhancements()
+    with instrumentation.track_render(st.session_state.page):
+        if st.session_state.page == 'login':
+            login_page()
+        elif st.session_state.page == 'register':
+            register_page()
+        elif st.session_state.page == 'customer_dashboard':
+            customer_dashboard()
+        elif st.session_state.page == 'project_manager_dashboard':
+            pm_dashboard()
+        elif st.session_state.page == 'it_director_dashboard':
+            it_director_dashboard()
+        elif st.session_state.page == 'roi_calculator':
+            roi_calculator()
+        elif st.session_state.page == 'existing_projects':
+            existing_projects()
+        elif st.session_state.page == 'enhancements':
+            enhancements()
+        elif st.session_state.page == 'query_stats':
+            query_stats_page()
     
     # Add navigation sidebar
     if st.session_state.page != 'login' and st.session_state.page != 'register':
@@ -1613,6 +1653,9 @@ def main():
                 if st.button("IT Director Dashboard"):
                     st.session_state.page = 'it_director_dashboard'
                     st.rerun()
+                if st.button("Query Statistics"):
+                    st.session_state.page = 'query_stats'
+                    st.rerun()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
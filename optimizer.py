@@ -0,0 +1,116 @@
+import bisect
+import numpy as np
+
+# Above this many candidates only the greedy heuristic is used
+EXACT_MAX_PROJECTS = 200
+# Branch-and-bound gives up and keeps its best selection so far after this many nodes
+NODE_LIMIT = 200_000
+
+class _NodeLimitReached(Exception):
+    pass
+
+def _feasible(usage, limits):
+    return np.all(usage <= limits + 1e-9, axis=-1)
+
+def greedy_selection(values, usage, limits):
+    """
+    Add projects in order of value per unit of (normalized) resource use while they fit.
+    usage is an (N, K) matrix of what each project consumes of K resources with limits
+    (budget first, then role hours). Returns the indices of the selected projects.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = (usage / np.where(limits > 0, limits, np.inf)).sum(axis=1)
+        ratio = np.where(weight > 0, values / weight, np.inf)
+    candidates = np.flatnonzero((values > 0) & _feasible(usage, limits))
+    
+    selected = []
+    remaining = limits.astype(float)
+    for i in candidates[np.argsort(-ratio[candidates], kind='stable')]:
+        if _feasible(usage[i], remaining):
+            selected.append(i)
+            remaining = remaining - usage[i]
+    
+    # The single most valuable project can beat the greedy fill
+    if candidates.size:
+        best = candidates[np.argmax(values[candidates])]
+        if values[best] > values[selected].sum():
+            selected = [best]
+    return np.array(sorted(selected), dtype=int)
+
+def branch_and_bound(values, usage, limits, node_limit=NODE_LIMIT):
+    """
+    Exact selection maximizing the total value within all limits.
+    Depth-first search over projects in order of value per unit of budget (the first
+    resource), pruned by the fractional knapsack bound on the budget. Starts from the
+    greedy selection. Returns (indices, exact); exact is False if node_limit was reached.
+    """
+    best = greedy_selection(values, usage, limits)
+    best_value = values[best].sum()
+    
+    candidates = np.flatnonzero((values > 0) & _feasible(usage, limits))
+    costs = usage[candidates, 0]
+    with np.errstate(divide='ignore'):
+        ratio = np.where(costs > 0, values[candidates] / costs, np.inf)
+    order = candidates[np.argsort(-ratio, kind='stable')]
+    
+    item_values = values[order]
+    item_usage = usage[order]
+    item_costs = item_usage[:, 0]
+    cost_prefix = np.concatenate([[0.0], np.cumsum(item_costs)]).tolist()
+    value_prefix = np.concatenate([[0.0], np.cumsum(item_values)]).tolist()
+    count = len(order)
+    
+    def bound(i, value, budget):
+        # Fill the remaining budget with items i.. in ratio order, the last one fractionally
+        j = bisect.bisect_right(cost_prefix, cost_prefix[i] + budget, lo=i) - 1
+        result = value + value_prefix[j] - value_prefix[i]
+        if j < count:
+            result += (budget - (cost_prefix[j] - cost_prefix[i])) * item_values[j] / item_costs[j]
+        return result
+    
+    nodes = 0
+    chosen = []
+    
+    def visit(i, value, remaining):
+        nonlocal nodes, best, best_value
+        nodes += 1
+        if nodes > node_limit:
+            raise _NodeLimitReached()
+        if value > best_value + 1e-9:
+            best_value = value
+            best = order[chosen]
+        if i == count or bound(i, value, remaining[0]) <= best_value + 1e-9:
+            return
+        if _feasible(item_usage[i], remaining):
+            chosen.append(i)
+            visit(i + 1, value + item_values[i], remaining - item_usage[i])
+            chosen.pop()
+        visit(i + 1, value, remaining)
+    
+    try:
+        visit(0, 0.0, limits.astype(float))
+        exact = True
+    except _NodeLimitReached:
+        exact = False
+    return np.array(sorted(best), dtype=int), exact
+
+def select_projects(values, costs, budget, role_hours=None, capacity=None, method='auto'):
+    """
+    Choose the projects that maximize the total value with total costs within budget and,
+    if given, the summed role_hours (N, R) within capacity (R limits, np.inf for none).
+    method is 'exact', 'greedy' or 'auto' (exact up to EXACT_MAX_PROJECTS candidates).
+    Returns (indices, method used).
+    """
+    values = np.asarray(values, dtype=float)
+    usage = np.asarray(costs, dtype=float)[:, None]
+    limits = np.array([budget], dtype=float)
+    if role_hours is not None and capacity is not None:
+        capacity = np.asarray(capacity, dtype=float)
+        limited = np.isfinite(capacity)
+        usage = np.hstack([usage, np.asarray(role_hours, dtype=float)[:, limited]])
+        limits = np.concatenate([limits, capacity[limited]])
+    
+    if method == 'greedy' or (method == 'auto' and np.count_nonzero(values > 0) > EXACT_MAX_PROJECTS):
+        return greedy_selection(values, usage, limits), 'greedy'
+    selected, exact = branch_and_bound(values, usage, limits)
+    return selected, 'exact' if exact else 'best found (search limit reached)'
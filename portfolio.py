@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import date
+import numpy as np
+import pandas as pd
+import cashflow
+import database as db
+import formulas
+import optimizer
+import rates
+import roi
+
+# Seconds a calculated portfolio is reused, like the database read cache. Writes made by
+# this process and rate or formula changes invalidate it sooner.
+PORTFOLIO_CACHE_SECONDS = db.READ_CACHE_TTL_SECONDS
+
+_portfolio_lock = threading.Lock()
+_portfolio_cache = None
+
+def load_portfolio_columns():
+    """
+    Load every project into the columnar form used by roi.calculate_roi_batch.
+    Returns (projects, columns, roles) where projects is a DataFrame with the id,
+    title, project_type and status of each row of the columns.
+    """
+    projects, input_rows, role_rows = db.get_portfolio_rows(roi.NUMERIC_INPUT_DEFAULTS)
+    projects = pd.DataFrame(projects, columns=['id', 'title', 'project_type', 'status'])
+    row_of = pd.Series(np.arange(len(projects)), index=projects['id'])
+    
+    columns = {key: np.full(len(projects), default, dtype=float)
+               for key, default in roi.NUMERIC_INPUT_DEFAULTS.items()}
+    if input_rows:
+        inputs = pd.DataFrame(input_rows, columns=['project_id', 'input_type', 'value'])
+        inputs = inputs[inputs['project_id'].isin(row_of.index)]
+        rows = row_of[inputs['project_id']].to_numpy()
+        for key, group in inputs.groupby('input_type'):
+            columns[key][rows[inputs['input_type'].to_numpy() == key]] = group['value'].to_numpy()
+    
+    roles = list(roi.ROLES)
+    role_hours = np.zeros((len(projects), len(roles)))
+    if role_rows:
+        hours = pd.DataFrame(role_rows, columns=['project_id', 'role', 'hours'])
+        hours = hours[hours['project_id'].isin(row_of.index)]
+        roles.extend(role for role in hours['role'].unique() if role not in roles)
+        role_index = pd.Series(np.arange(len(roles)), index=roles)
+        role_hours = np.zeros((len(projects), len(roles)))
+        role_hours[row_of[hours['project_id']].to_numpy(), role_index[hours['role']].to_numpy()] = hours['hours'].to_numpy()
+    columns['role_hours'] = role_hours
+    
+    return projects, columns, tuple(roles)
+
+def portfolio_roi():
+    """
+    Calculate the ROI, NPV, IRR and payback month of every project in one vectorized pass;
+    returns a DataFrame. The result is shared by all sessions until the data it depends on changes.
+    """
+    global _portfolio_cache
+    # The rate card in effect depends on the date as well
+    key = (db.data_version(), db.get_rates_revision(), db.get_formulas_revision(), date.today())
+    with _portfolio_lock:
+        cached = _portfolio_cache
+    if cached and cached[0] == key and time.monotonic() - cached[1] < PORTFOLIO_CACHE_SECONDS:
+        return cached[2].copy()
+    
+    projects = _calculate_portfolio_roi()
+    with _portfolio_lock:
+        _portfolio_cache = (key, time.monotonic(), projects)
+    return projects.copy()
+
+def _calculate_portfolio_roi():
+    projects, columns, roles = load_portfolio_columns()
+    project_rates = rates.rate_card().rate_matrix(roles, projects['project_type'])
+    project_formulas = formulas.formula_registry().for_types(projects['project_type'])
+    results = roi.calculate_roi_batch(columns, roles, project_rates, project_formulas)
+    results.update(cashflow.cash_flow_metrics(columns, roles, project_rates, formulas=project_formulas))
+    for key, values in results.items():
+        projects[key] = values
+    return projects
+
+def optimize_portfolio(budget, objective='total_benefits', capacity=None, status='estimated_by_pm', method='auto'):
+    """
+    Choose the projects with the given status that maximize objective ('total_benefits'
+    or 'npv') with total costs within budget and role hours within capacity ({role: hours}).
+    Returns (candidates DataFrame with a 'selected' column, method used).
+    """
+    projects, columns, roles = load_portfolio_columns()
+    mask = (projects['status'] == status).to_numpy()
+    projects = projects[mask].reset_index(drop=True)
+    columns = {key: values[mask] for key, values in columns.items()}
+    
+    project_rates = rates.rate_card().rate_matrix(roles, projects['project_type'])
+    project_formulas = formulas.formula_registry().for_types(projects['project_type'])
+    results = roi.calculate_roi_batch(columns, roles, project_rates, project_formulas)
+    for key in ('total_benefits', 'total_costs', 'roi'):
+        projects[key] = results[key]
+    projects['npv'] = cashflow.cash_flow_metrics(columns, roles, project_rates, formulas=project_formulas,
+                                                 metrics=('npv',))['npv']
+    
+    limits = [capacity.get(role, np.inf) for role in roles] if capacity else None
+    selected, method = optimizer.select_projects(
+        projects[objective].to_numpy(), projects['total_costs'].to_numpy(), budget,
+        columns['role_hours'], limits, method
+    )
+    projects['selected'] = False
+    projects.loc[selected, 'selected'] = True
+    return projects, method
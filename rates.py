@@ -0,0 +1,72 @@
+import threading
+from datetime import date
+import numpy as np
+import database as db
+import roi
+
+_lock = threading.Lock()
+_rate_card = None
+_rate_card_key = None
+
+class RateCard:
+    """
+    Hourly rates in effect on one date, as a matrix with a row of rates for every project
+    type plus a first row for types without overrides, and one column per role.
+    """
+    
+    def __init__(self, rows, as_of):
+        self.as_of = as_of
+        # Date of the latest rate change in effect
+        self.effective_from = db.DEFAULT_RATES_EFFECTIVE_FROM
+        defaults = {}
+        overrides = {}
+        # Rows are ordered by effective date, so later rates replace earlier ones
+        for _, role, project_type, hourly_rate, effective_from in rows:
+            if effective_from > as_of:
+                continue
+            self.effective_from = max(self.effective_from, effective_from)
+            if project_type:
+                overrides.setdefault(project_type, {})[role] = hourly_rate
+            else:
+                defaults[role] = hourly_rate
+        
+        roles = list(defaults)
+        for type_rates in overrides.values():
+            roles.extend(role for role in type_rates if role not in roles)
+        self.roles = tuple(roles)
+        self.project_types = tuple(overrides)
+        self._role_index = {role: i for i, role in enumerate(self.roles)}
+        self._type_index = {project_type: i + 1 for i, project_type in enumerate(self.project_types)}
+        
+        # The extra last column holds the rate of roles missing from the card
+        default_row = [defaults.get(role, roi.DEFAULT_RATE) for role in self.roles] + [roi.DEFAULT_RATE]
+        self.matrix = np.tile(np.array(default_row, dtype=float), (1 + len(self.project_types), 1))
+        for project_type, type_rates in overrides.items():
+            for role, hourly_rate in type_rates.items():
+                self.matrix[self._type_index[project_type], self._role_index[role]] = hourly_rate
+    
+    def rates_for(self, project_type=None):
+        """{role: hourly rate} for one project type"""
+        row = self.matrix[self._type_index.get(project_type, 0)]
+        return dict(zip(self.roles, row.tolist()))
+    
+    def rate_matrix(self, roles, project_types):
+        """(len(project_types), len(roles)) matrix with the rates of each project, for roi.calculate_roi_batch"""
+        columns = [self._role_index.get(role, -1) for role in roles]
+        rows = [self._type_index.get(project_type, 0) for project_type in project_types]
+        return self.matrix[np.ix_(rows, columns)]
+
+def rate_card(as_of=None):
+    """
+    Return the rate card in effect on as_of (an ISO date, today by default).
+    The card is kept in memory and rebuilt only when the rates table changed, which is
+    checked with one cheap query, so changes made by other processes are picked up too.
+    """
+    global _rate_card, _rate_card_key
+    as_of = as_of or date.today().isoformat()
+    key = (db.get_rates_revision(), as_of)
+    with _lock:
+        if _rate_card_key != key:
+            _rate_card = RateCard(db.get_rates(), as_of)
+            _rate_card_key = key
+        return _rate_card
@@ -0,0 +1,495 @@
+import ast
+import functools
+import hashlib
+import json
+import math
+import numpy as np
+
+# Bump when the formulas below change so stored ROI results are recomputed
+MODEL_VERSION = 1
+
+# Standard hourly rates; they seed the rates table and apply when no rate card is given
+STANDARD_RATES = {
+    'Business Analyst': 100,
+    'Project Manager': 150,
+    'UI/UX Designer': 120,
+    'Frontend Developer': 120,
+    'Backend Developer': 120,
+    'DevOps Engineer': 130,
+    'QA Engineer': 100,
+    'Data Engineer': 130,
+    'Security Engineer': 140,
+    'Technical Lead': 160
+}
+DEFAULT_RATE = 120
+
+# Column order of the role-hours matrix used by the batch engine
+ROLES = tuple(STANDARD_RATES)
+
+# Inputs the ROI depends on; comments and other inputs do not affect the result
+ROI_INPUT_KEYS = (
+    'expected_revenue',
+    'time_savings',
+    'efficiency_improvement',
+    'project_duration',
+    'role_hours',
+    'infrastructure_cost',
+    'software_licenses',
+    'training_cost',
+    'maintenance_period',
+)
+
+# Default of every numeric input when a project does not set it
+NUMERIC_INPUT_DEFAULTS = {
+    'expected_revenue': 0.0,
+    'time_savings': 0.0,
+    'efficiency_improvement': 0.0,
+    'project_duration': 1.0,
+    'infrastructure_cost': 0.0,
+    'software_licenses': 0.0,
+    'training_cost': 0.0,
+    'maintenance_period': 0.0,
+}
+
+# Benefit and cost formulas: name -> expression over the numeric inputs, labor_cost and
+# other formulas. Expressions may use + - * / **, comparisons, 'a if condition else b',
+# min(a, b), max(a, b) and abs(a); exponents must be numbers of at most MAX_EXPONENT. The
+# formulas table can override them per project type (see formulas.py).
+FORMULAS = {
+    # Convert efficiency improvement percentage to monetary value,
+    # assuming efficiency improvement affects 20% of annual revenue
+    'annual_revenue': 'expected_revenue / (project_duration / 12)',
+    'efficiency_value': '(annual_revenue * 0.2 * efficiency_improvement / 100) * (project_duration / 12)',
+    'total_benefits': 'expected_revenue + time_savings + efficiency_value',
+    'total_costs': 'labor_cost + infrastructure_cost + software_licenses + training_cost',
+    'roi': '(total_benefits - total_costs) / total_costs * 100 if total_costs > 0 else 0',
+}
+
+# Formulas every formula set defines, as the ROI results are made of them
+REQUIRED_FORMULAS = ('efficiency_value', 'total_benefits', 'total_costs', 'roi')
+
+# Values formulas can refer to besides other formulas
+FORMULA_VARIABLES = tuple(NUMERIC_INPUT_DEFAULTS) + ('labor_cost',)
+
+# Largest exponent of '**'; larger or computed exponents could take forever to evaluate
+MAX_EXPONENT = 12
+
+# Single projects are calculated on NumPy scalars, so they follow the same arithmetic as batches:
+# a division by zero gives inf or nan instead of raising
+_SCALAR_FUNCTIONS = {'min': np.minimum, 'max': np.maximum, 'abs': np.abs, 'number': np.float64}
+_VECTOR_FUNCTIONS = {'min': np.minimum, 'max': np.maximum, 'abs': np.abs, 'where': np.where, 'number': np.float64}
+_FUNCTION_ARGUMENTS = {'min': 2, 'max': 2, 'abs': 1}
+
+_ALLOWED_SYNTAX = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.UAdd, ast.USub,
+    ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq,
+)
+
+def _constant_exponent(node):
+    """Value of a number exponent such as 2 or -1, or None for anything else"""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _constant_exponent(node.operand)
+        return value if value is None or isinstance(node.op, ast.UAdd) else -value
+    if isinstance(node, ast.Constant):
+        return node.value
+    return None
+
+class _NumberConstants(ast.NodeTransformer):
+    """
+    Make number constants NumPy floats, so terms of constants alone follow the same
+    arithmetic as the inputs and never become huge integers
+    """
+    
+    def visit_Constant(self, node):
+        call = ast.Call(ast.Name('number', ast.Load()), [ast.Constant(float(node.value))], [])
+        return ast.copy_location(call, node)
+
+class _Vectorize(ast.NodeTransformer):
+    """Rewrite 'a if condition else b' into where(condition, a, b)"""
+    
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        call = ast.Call(ast.Name('where', ast.Load()), [node.test, node.body, node.orelse], [])
+        return ast.copy_location(call, node)
+
+def _parse_formula(name, expression):
+    """Check a formula expression; returns its syntax tree and the names it refers to"""
+    if not name.isidentifier() or name in FORMULA_VARIABLES or name in _VECTOR_FUNCTIONS:
+        raise ValueError(f"Invalid formula name: {name}")
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Formula {name}: {e.msg}") from None
+    
+    dependencies = []
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_SYNTAX):
+            raise ValueError(f"Formula {name}: {type(node).__name__} is not allowed")
+        if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            raise ValueError(f"Formula {name}: only numbers are allowed as constants")
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError(f"Formula {name}: chained comparisons are not allowed")
+        if isinstance(node, ast.Call):
+            function = node.func.id if isinstance(node.func, ast.Name) else None
+            if function not in _FUNCTION_ARGUMENTS or node.keywords or len(node.args) != _FUNCTION_ARGUMENTS[function]:
+                raise ValueError(f"Formula {name}: unsupported function call")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            exponent = _constant_exponent(node.right)
+            if exponent is None or abs(exponent) > MAX_EXPONENT:
+                raise ValueError(f"Formula {name}: exponents must be numbers between -{MAX_EXPONENT} and {MAX_EXPONENT}")
+    
+    tree = ast.fix_missing_locations(_NumberConstants().visit(tree))
+    functions = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in functions and node.id not in dependencies:
+            dependencies.append(node.id)
+    return tree, tuple(dependencies)
+
+def _compile_formula(tree, dependencies, functions):
+    """Turn a checked expression into a function taking its dependencies in order"""
+    source = f"lambda {', '.join(dependencies)}: {ast.unparse(tree.body)}"
+    return eval(compile(source, '<formula>', 'eval'), {'__builtins__': {}, **functions})
+
+def formulas_version(expressions):
+    """Short hash identifying a set of formula expressions"""
+    payload = json.dumps(expressions, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+def _labor_cost(role_hours, rates):
+    # Calculate labor costs based on role hours and rates
+    total_labor_cost = np.float64(0)
+    for role, hours in role_hours.items():
+        if hours > 0:
+            rate = rates.get(role, DEFAULT_RATE)  # Default rate if role not found
+            total_labor_cost += float(hours) * rate
+    return total_labor_cost
+
+class FormulaSet:
+    """
+    Formula expressions compiled once into functions of NumPy scalars for single projects
+    and of NumPy arrays for batches, in dependency order. Use compile_formulas() to get one.
+    graph is the dependency graph of a single project's ROI: derived quantity ->
+    (function, the inputs and quantities it is calculated from), in evaluation order.
+    """
+    
+    def __init__(self, expressions, version):
+        self.expressions = dict(expressions)
+        self.version = version
+        missing = [name for name in REQUIRED_FORMULAS if name not in self.expressions]
+        if missing:
+            raise ValueError(f"Missing formulas: {', '.join(missing)}")
+        parsed = {name: _parse_formula(name, expression) for name, expression in self.expressions.items()}
+        
+        # Order formulas so every one comes after the formulas it uses
+        order = []
+        visiting = set()
+        
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Formula {name} is part of a circular dependency")
+            visiting.add(name)
+            for dependency in parsed[name][1]:
+                if dependency in parsed:
+                    visit(dependency)
+                elif dependency not in FORMULA_VARIABLES:
+                    raise ValueError(f"Formula {name}: unknown name {dependency}")
+            visiting.discard(name)
+            order.append(name)
+        
+        for name in parsed:
+            visit(name)
+        
+        self.vector = {}
+        self.graph = {'labor_cost': (_labor_cost, ('role_hours', 'rates'))}
+        for name in order:
+            tree, dependencies = parsed[name]
+            vector_tree = ast.fix_missing_locations(_Vectorize().visit(ast.parse(ast.unparse(tree), mode='eval')))
+            self.vector[name] = (_compile_formula(vector_tree, dependencies, _VECTOR_FUNCTIONS), dependencies)
+            self.graph[name] = (_compile_formula(tree, dependencies, _SCALAR_FUNCTIONS), dependencies)
+    
+    def __reduce__(self):
+        # Compiled functions cannot be pickled; other processes compile the expressions again
+        return compile_formulas, (self.expressions,)
+    
+    def evaluate(self, values):
+        """Evaluate every formula on a dictionary of equally long input arrays, adding the results to it"""
+        size = len(values['labor_cost'])
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for name, (func, dependencies) in self.vector.items():
+                result = func(*(values[dependency] for dependency in dependencies))
+                values[name] = np.broadcast_to(np.asarray(result, dtype=float), (size,))
+        return values
+
+# Compiled formula sets kept, least recently used first out; the formula registry needs one
+# per project type, and every checked formula change compiles a few more
+FORMULA_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _compile_formulas(version, items):
+    return FormulaSet(dict(items), version)
+
+def compile_formulas(expressions=None):
+    """
+    FormulaSet of {name: expression} (FORMULAS by default), compiled once per formula
+    version while it is among the FORMULA_CACHE_SIZE most recently used. Raises ValueError
+    for an invalid expression, unknown name or circular formulas.
+    """
+    if expressions is None:
+        expressions = FORMULAS
+    return _compile_formulas(formulas_version(expressions), tuple(expressions.items()))
+
+DEFAULT_FORMULAS = compile_formulas()
+
+# The ROI model as a dependency graph of the default formulas. compute_roi evaluates
+# every node, RoiGraph only the nodes downstream of changed inputs.
+ROI_GRAPH = DEFAULT_FORMULAS.graph
+
+def _graph_inputs(inputs, rates):
+    """Values of the graph's input nodes, with the same defaults as the input forms"""
+    values = {key: np.float64(inputs.get(key, default)) for key, default in NUMERIC_INPUT_DEFAULTS.items()}
+    values['role_hours'] = dict(inputs.get('role_hours', {}))
+    values['rates'] = STANDARD_RATES if rates is None else rates
+    return values
+
+def _finite(value):
+    """A formula result as a float, with 0 for undefined results such as a division by zero"""
+    value = float(value)
+    return value if math.isfinite(value) else 0.0
+
+def _roi_result(values):
+    """
+    Result dictionary of compute_roi from the values of all graph nodes; like
+    calculate_roi_batch, it is empty for a zero duration and undefined results are 0.
+    """
+    if values['project_duration'] == 0:
+        return empty_roi()
+    return {
+        'total_benefits': _finite(values['total_benefits']),
+        'total_costs': _finite(values['total_costs']),
+        'roi': _finite(values['roi']),
+        'benefits_breakdown': {
+            'expected_revenue': _finite(values['expected_revenue']),
+            'time_savings': _finite(values['time_savings']),
+            'efficiency_improvement': _finite(values['efficiency_improvement'])
+        },
+        'costs_breakdown': {
+            'labor': _finite(values['labor_cost']),
+            'infrastructure': _finite(values['infrastructure_cost']),
+            'software': _finite(values['software_licenses']),
+            'training': _finite(values['training_cost'])
+        }
+    }
+
+def compute_roi(inputs, rates=None, formulas=None):
+    """
+    Calculate benefits, costs and ROI from a project's inputs.
+    rates maps roles to hourly rates (STANDARD_RATES by default) and formulas is a
+    FormulaSet (DEFAULT_FORMULAS by default).
+    This is a pure function; it neither reads nor writes the database.
+    """
+    graph = (formulas or DEFAULT_FORMULAS).graph
+    values = _graph_inputs(inputs, rates)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for node, (func, dependencies) in graph.items():
+            values[node] = func(*(values[dependency] for dependency in dependencies))
+    return _roi_result(values)
+
+class RoiGraph:
+    """
+    Memoized ROI of one project that is updated incrementally.
+    update() recalculates only the nodes of the formulas' graph downstream of inputs whose value
+    changed, and stops propagating where a recalculated node keeps its value. After each
+    update, changed holds the input and derived nodes whose value changed and recomputed
+    the derived nodes that were calculated again.
+    """
+    
+    def __init__(self, inputs=None, rates=None, formulas=None):
+        self.inputs = dict(inputs or {})
+        self.rates = rates
+        self.formulas = formulas or DEFAULT_FORMULAS
+        self.graph = self.formulas.graph
+        self.values = {}
+        self.changed = set()
+        self.recomputed = set()
+        self._evaluate(_graph_inputs(self.inputs, rates))
+    
+    def _evaluate(self, new_values):
+        changed = {node for node, value in new_values.items()
+                   if node not in self.values or self.values[node] != value}
+        self.values.update(new_values)
+        
+        recomputed = set()
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for node, (func, dependencies) in self.graph.items():
+                if node in self.values and changed.isdisjoint(dependencies):
+                    continue
+                value = func(*(self.values[dependency] for dependency in dependencies))
+                recomputed.add(node)
+                if node not in self.values or self.values[node] != value:
+                    changed.add(node)
+                self.values[node] = value
+        
+        self.changed = changed
+        self.recomputed = recomputed
+        return changed
+    
+    def update(self, changes=None, rates=None):
+        """
+        Apply changed inputs (a dictionary with some input keys) and, if given, new rates.
+        Returns the set of nodes whose value changed.
+        """
+        self.inputs.update(changes or {})
+        if rates is not None:
+            self.rates = rates
+        return self._evaluate(_graph_inputs(self.inputs, self.rates))
+    
+    def result(self):
+        """Current result, in the same form as compute_roi"""
+        return _roi_result(self.values)
+
+def role_rates(roles=ROLES, rates=None):
+    """Hourly rate vector for the columns of a role-hours matrix, from a {role: rate} dictionary"""
+    if rates is None:
+        rates = STANDARD_RATES
+    return np.array([rates.get(role, DEFAULT_RATE) for role in roles], dtype=float)
+
+def columns_from_inputs(inputs_list):
+    """
+    Convert a list of input dictionaries into the columnar form used by calculate_roi_batch.
+    Returns (columns, roles); roles lists the role-hours matrix columns, with any role
+    without a standard rate appended after ROLES.
+    """
+    roles = list(ROLES)
+    for inputs in inputs_list:
+        for role in inputs.get('role_hours', {}):
+            if role not in roles:
+                roles.append(role)
+    role_index = {role: i for i, role in enumerate(roles)}
+    
+    columns = {key: np.array([float(inputs.get(key, default)) for inputs in inputs_list], dtype=float)
+               for key, default in NUMERIC_INPUT_DEFAULTS.items()}
+    role_hours = np.zeros((len(inputs_list), len(roles)))
+    for row, inputs in enumerate(inputs_list):
+        for role, hours in inputs.get('role_hours', {}).items():
+            role_hours[row, role_index[role]] = float(hours)
+    columns['role_hours'] = role_hours
+    return columns, tuple(roles)
+
+def repeat_project(inputs, size, extra_roles=()):
+    """
+    Columns holding size copies of one project, for evaluating variations of it in one batch.
+    extra_roles adds role-hours columns the project does not have yet.
+    """
+    role_hours = dict(inputs.get('role_hours', {}))
+    for role in extra_roles:
+        role_hours.setdefault(role, 0)
+    base, roles = columns_from_inputs([dict(inputs, role_hours=role_hours)])
+    columns = {key: np.repeat(values, size, axis=0) for key, values in base.items()}
+    return columns, roles
+
+def _batch_values(columns, roles, rates, formulas):
+    """Inputs, labor cost and formula results of a batch, before undefined results are zeroed"""
+    values = {key: np.asarray(columns[key], dtype=float) for key in NUMERIC_INPUT_DEFAULTS}
+    role_hours = np.asarray(columns['role_hours'], dtype=float)
+    if rates is None:
+        rates = role_rates(roles)
+    if formulas is None:
+        formulas = DEFAULT_FORMULAS
+    
+    # Only positive hours count towards labor
+    billable_hours = np.where(role_hours > 0, role_hours, 0.0)
+    rates = np.asarray(rates, dtype=float)
+    if rates.ndim == 2:
+        values['labor_cost'] = np.einsum('ij,ij->i', billable_hours, rates)
+    else:
+        values['labor_cost'] = billable_hours @ rates
+    
+    if isinstance(formulas, FormulaSet):
+        formulas.evaluate(values)
+    else:
+        # Evaluate each distinct formula set on its own projects
+        groups = {}
+        for row, formula_set in enumerate(formulas):
+            groups.setdefault(formula_set.version, (formula_set, []))[1].append(row)
+        results = {name: np.zeros(len(values['labor_cost'])) for name in REQUIRED_FORMULAS}
+        for formula_set, rows in groups.values():
+            group_values = formula_set.evaluate({key: column[rows] for key, column in values.items()})
+            for name in REQUIRED_FORMULAS:
+                results[name][rows] = group_values[name]
+        values.update(results)
+    return values
+
+def calculate_roi_batch(columns, roles=ROLES, rates=None, formulas=None):
+    """
+    Vectorized compute_roi for many projects at once.
+    columns maps each key of NUMERIC_INPUT_DEFAULTS to a 1-D array with one value per
+    project, and 'role_hours' to an (N, len(roles)) matrix. Returns a dictionary of
+    1-D arrays with the same results as compute_roi for every project.
+    rates is a rate vector for roles, or an (N, len(roles)) matrix with each project's rates;
+    it defaults to role_rates(roles). formulas is a FormulaSet, or a sequence with each
+    project's FormulaSet; it defaults to DEFAULT_FORMULAS.
+    """
+    values = _batch_values(columns, roles, rates, formulas)
+    # Projects without a duration get the empty result
+    valid = values['project_duration'] != 0
+    
+    result = {
+        'total_benefits': values['total_benefits'],
+        'total_costs': values['total_costs'],
+        'roi': values['roi'],
+        'efficiency_value': values['efficiency_value'],
+        'labor_cost': values['labor_cost'],
+        'infrastructure_cost': values['infrastructure_cost'],
+        'software_cost': values['software_licenses'],
+        'training_cost': values['training_cost']
+    }
+    # Undefined results, such as a division by zero, are 0 as in compute_roi
+    return {key: np.where(valid & np.isfinite(column), column, 0.0) for key, column in result.items()}
+
+def undefined_formulas(columns, roles=ROLES, rates=None, formulas=None):
+    """
+    Find projects for which a required formula has no finite value, e.g. after a division
+    by zero; compute_roi and calculate_roi_batch report those results as 0. Takes the same
+    arguments as calculate_roi_batch and returns (row, formula name) of one such
+    project with a duration, or None.
+    """
+    values = _batch_values(columns, roles, rates, formulas)
+    valid = values['project_duration'] != 0
+    for name in REQUIRED_FORMULAS:
+        rows = np.flatnonzero(valid & ~np.isfinite(values[name]))
+        if len(rows):
+            return int(rows[0]), name
+    return None
+
+def empty_roi():
+    """ROI result used when a project cannot be calculated"""
+    return {
+        'total_benefits': 0,
+        'total_costs': 0,
+        'roi': 0,
+        'benefits_breakdown': {
+            'expected_revenue': 0,
+            'time_savings': 0,
+            'efficiency_improvement': 0
+        },
+        'costs_breakdown': {
+            'labor': 0,
+            'infrastructure': 0,
+            'software': 0,
+            'training': 0
+        }
+    }
+
+def inputs_hash(inputs, rates=None, formulas=None):
+    """Stable hash of the inputs, hourly rates and formulas the ROI depends on, including the model version"""
+    if rates is None:
+        rates = STANDARD_RATES
+    if formulas is None:
+        formulas = DEFAULT_FORMULAS
+    relevant = {key: inputs.get(key) for key in ROI_INPUT_KEYS}
+    used_rates = {role: rates.get(role, DEFAULT_RATE) for role in inputs.get('role_hours') or {}}
+    payload = json.dumps([MODEL_VERSION, formulas.version, relevant, used_rates], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
@@ -0,0 +1,122 @@
+import numpy as np
+import cashflow
+import roi
+
+# Inputs that can be varied, with their display names.
+# LABOR_HOURS scales the hours of every role at once.
+LABOR_HOURS = 'labor_hours'
+SENSITIVITY_INPUTS = {
+    'expected_revenue': 'Expected Revenue',
+    'time_savings': 'Time Savings',
+    'efficiency_improvement': 'Efficiency Improvement',
+    LABOR_HOURS: 'Labor Hours',
+    'infrastructure_cost': 'Infrastructure Cost',
+    'software_licenses': 'Software Licenses',
+    'training_cost': 'Training Cost',
+    'maintenance_period': 'Maintenance Period',
+}
+
+DEFAULT_DELTA = 0.2
+GRID_STEPS = 50
+
+# Result metrics, each calculated for a whole batch of variations at once
+METRICS = {
+    'roi': lambda columns, roles, rates, formulas: roi.calculate_roi_batch(columns, roles, rates, formulas)['roi'],
+    'npv': lambda columns, roles, rates, formulas: cashflow.cash_flow_metrics(columns, roles, rates, formulas=formulas,
+                                                                              metrics=('npv',))['npv'],
+}
+
+def sensitivity_inputs(metric='roi', formulas=None):
+    """
+    {input key: display name} of the SENSITIVITY_INPUTS that can change a metric. NPV
+    covers the whole cash flow and depends on all of them; the ROI only on the inputs its
+    formulas (a roi.FormulaSet) use, which with the standard formulas leaves out the
+    maintenance period.
+    """
+    if metric != 'roi':
+        return dict(SENSITIVITY_INPUTS)
+    graph = (formulas or roi.DEFAULT_FORMULAS).graph
+    used = set()
+    pending = ['roi']
+    while pending:
+        node = pending.pop()
+        if node not in used:
+            used.add(node)
+            pending.extend(graph[node][1] if node in graph else ())
+    return {key: label for key, label in SENSITIVITY_INPUTS.items()
+            if ('role_hours' if key == LABOR_HOURS else key) in used}
+
+def _scale(columns, key, rows, factors):
+    """Multiply one input of the given batch rows by factors"""
+    if key == LABOR_HOURS:
+        columns['role_hours'][rows] *= np.asarray(factors)[:, None]
+    else:
+        columns[key][rows] *= factors
+
+def tornado(inputs, deltas=None, metric='roi', rates=None, formulas=None):
+    """
+    Change each input down and up by its relative delta, one input at a time.
+    deltas maps input keys to a delta (e.g. 0.2 for +/-20%) or a (down, up) pair; by
+    default every input of sensitivity_inputs(metric, formulas) moves by DEFAULT_DELTA.
+    All variations are evaluated in one batch. rates maps roles to hourly rates; formulas
+    is a roi.FormulaSet. Returns the base value and one row per input, largest swing first.
+    """
+    if deltas is None:
+        deltas = dict.fromkeys(sensitivity_inputs(metric, formulas), DEFAULT_DELTA)
+    keys = list(deltas)
+    columns, roles = roi.repeat_project(inputs, 1 + 2 * len(keys))
+    
+    # Row 0 is the unchanged project, then a low and a high row per input
+    for i, key in enumerate(keys):
+        delta = deltas[key]
+        down, up = delta if isinstance(delta, (tuple, list)) else (delta, delta)
+        _scale(columns, key, [1 + 2 * i, 2 + 2 * i], np.array([1 - down, 1 + up]))
+    
+    values = METRICS[metric](columns, roles, roi.role_rates(roles, rates), formulas)
+    rows = []
+    for i, key in enumerate(keys):
+        low, high = values[1 + 2 * i], values[2 + 2 * i]
+        rows.append({
+            'input': key,
+            'label': SENSITIVITY_INPUTS.get(key, key),
+            'low': float(low),
+            'high': float(high),
+            'swing': float(abs(high - low))
+        })
+    rows.sort(key=lambda row: row['swing'], reverse=True)
+    return {'metric': metric, 'base': float(values[0]), 'rows': rows}
+
+def grid_factors(delta=DEFAULT_DELTA, steps=GRID_STEPS):
+    """Evenly spaced factors from 1 - delta to 1 + delta"""
+    return np.linspace(1 - delta, 1 + delta, steps)
+
+def grid(inputs, x_key, y_key, x_factors=None, y_factors=None, metric='roi', rates=None, formulas=None):
+    """
+    Two-way sensitivity: the metric for every combination of factors applied to two inputs,
+    evaluated in one batch. Factors default to grid_factors(). The two inputs must differ.
+    Returns the factors and a (len(y_factors), len(x_factors)) matrix of values.
+    """
+    if x_key == y_key:
+        raise ValueError(f"The two inputs of a sensitivity grid must differ, got {x_key} twice")
+    if x_factors is None:
+        x_factors = grid_factors()
+    if y_factors is None:
+        y_factors = grid_factors()
+    x_factors = np.asarray(x_factors, dtype=float)
+    y_factors = np.asarray(y_factors, dtype=float)
+    
+    x_grid, y_grid = np.meshgrid(x_factors, y_factors)
+    rows = np.arange(x_grid.size)
+    columns, roles = roi.repeat_project(inputs, x_grid.size)
+    _scale(columns, x_key, rows, x_grid.ravel())
+    _scale(columns, y_key, rows, y_grid.ravel())
+    
+    values = METRICS[metric](columns, roles, roi.role_rates(roles, rates), formulas)
+    return {
+        'metric': metric,
+        'x_key': x_key,
+        'y_key': y_key,
+        'x_factors': x_factors.tolist(),
+        'y_factors': y_factors.tolist(),
+        'values': values.reshape(x_grid.shape)
+    }
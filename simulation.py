@@ -0,0 +1,143 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import roi
+
+# Scenarios per chunk; with processes > 1, runs with several chunks are spread over a
+# process pool. Every chunk has its own seed, so results do not depend on the number of processes.
+CHUNK_SIZE = 250_000
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+HISTOGRAM_BINS = 50
+
+# Inputs that set the project timeline rather than an amount; they keep their point value
+TIMELINE_INPUTS = ('project_duration', 'maintenance_period')
+
+# Key prefix for distributions of a single role's hours, e.g. 'role_hours.QA Engineer'
+ROLE_HOURS_PREFIX = 'role_hours.'
+
+_pool = None
+_pool_processes = None
+_pool_lock = threading.Lock()
+
+def sample(spec, size, rng):
+    """
+    Draw size samples from a distribution spec:
+    {'kind': 'triangular' | 'pert', 'low': ..., 'mode': ..., 'high': ...},
+    {'kind': 'normal', 'mean': ..., 'std': ...} or {'kind': 'fixed', 'value': ...}
+    """
+    kind = spec['kind']
+    if kind == 'fixed':
+        return np.full(size, float(spec['value']))
+    if kind == 'normal':
+        return rng.normal(spec['mean'], spec['std'], size)
+    
+    low, mode, high = float(spec['low']), float(spec['mode']), float(spec['high'])
+    if high <= low:
+        return np.full(size, mode)
+    if kind == 'triangular':
+        return rng.triangular(low, mode, high, size)
+    if kind == 'pert':
+        shape = spec.get('lambda', 4)
+        alpha = 1 + shape * (mode - low) / (high - low)
+        beta = 1 + shape * (high - mode) / (high - low)
+        return low + rng.beta(alpha, beta, size) * (high - low)
+    raise ValueError(f"Unknown distribution kind: {kind}")
+
+def default_distributions(inputs, spread, kind='triangular'):
+    """
+    Put a distribution of the given kind around every non-zero numeric input and role hours.
+    spread is the relative half-width, e.g. 0.2 for +/-20%.
+    """
+    points = {key: float(inputs[key]) for key in roi.NUMERIC_INPUT_DEFAULTS
+              if key in inputs and key not in TIMELINE_INPUTS}
+    for role, hours in inputs.get('role_hours', {}).items():
+        points[ROLE_HOURS_PREFIX + role] = float(hours)
+    
+    distributions = {}
+    for key, value in points.items():
+        if value == 0:
+            continue
+        if kind == 'normal':
+            # +/-spread covers three standard deviations
+            distributions[key] = {'kind': 'normal', 'mean': value, 'std': abs(value) * spread / 3}
+        else:
+            low, high = sorted((value * (1 - spread), value * (1 + spread)))
+            distributions[key] = {'kind': kind, 'low': low, 'mode': value, 'high': high}
+    return distributions
+
+def _scenario_columns(inputs, distributions, size, rng):
+    """Build calculate_roi_batch columns holding size sampled scenarios of one project"""
+    extra_roles = [key[len(ROLE_HOURS_PREFIX):] for key in distributions if key.startswith(ROLE_HOURS_PREFIX)]
+    columns, roles = roi.repeat_project(inputs, size, extra_roles)
+    
+    # Sample in sorted key order so a seed always gives the same scenarios
+    for key in sorted(distributions):
+        values = sample(distributions[key], size, rng)
+        if key.startswith(ROLE_HOURS_PREFIX):
+            columns['role_hours'][:, roles.index(key[len(ROLE_HOURS_PREFIX):])] = values
+        else:
+            columns[key] = values
+    return columns, roles
+
+def _simulate_chunk(inputs, distributions, size, seed, rates, formulas):
+    rng = np.random.default_rng(seed)
+    columns, roles = _scenario_columns(inputs, distributions, size, rng)
+    return roi.calculate_roi_batch(columns, roles, roi.role_rates(roles, rates), formulas)['roi']
+
+def _process_pool(processes):
+    """
+    Process pool kept for the life of the process and replaced only when the number of
+    processes changes. Its processes are spawned, as forking a threaded process such as
+    the Streamlit server can deadlock.
+    """
+    global _pool, _pool_processes
+    with _pool_lock:
+        if _pool is None or _pool_processes != processes:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+            _pool_processes = processes
+        return _pool
+
+def simulate_roi(inputs, distributions, scenarios=100_000, seed=0, processes=1, rates=None, formulas=None):
+    """
+    Monte Carlo ROI of one project.
+    distributions maps input keys (or 'role_hours.<role>') to distribution specs; other
+    inputs keep their point value. rates maps roles to hourly rates and formulas is a
+    roi.FormulaSet. Returns the mean, standard deviation, percentiles, probability of a
+    negative ROI and a histogram of the simulated ROI.
+    Runs in the calling process by default; one batch of NumPy operations per chunk is
+    faster than sending chunks to other processes unless several CPUs are free. processes
+    > 1 (or None for one per CPU) spreads chunks over a long-lived pool of spawned processes.
+    """
+    chunks = max(1, -(-scenarios // CHUNK_SIZE))
+    sizes = [CHUNK_SIZE] * (chunks - 1) + [scenarios - CHUNK_SIZE * (chunks - 1)]
+    seeds = np.random.SeedSequence(seed).spawn(chunks)
+    
+    if chunks > 1 and processes != 1:
+        pool = _process_pool(processes)
+        results = list(pool.map(_simulate_chunk, repeat(inputs), repeat(distributions), sizes, seeds, repeat(rates),
+                                repeat(formulas)))
+    else:
+        results = [_simulate_chunk(inputs, distributions, size, chunk_seed, rates, formulas)
+                   for size, chunk_seed in zip(sizes, seeds)]
+    return summarize(np.concatenate(results))
+
+def summarize(roi_values):
+    """Summary statistics of simulated ROI values"""
+    percentiles = np.percentile(roi_values, PERCENTILES)
+    # Leave the extreme tails out of the histogram so the bulk stays readable
+    low, high = np.percentile(roi_values, [1, 99])
+    if high <= low:
+        high = low + 1
+    counts, edges = np.histogram(roi_values, bins=HISTOGRAM_BINS, range=(low, high))
+    return {
+        'scenarios': int(roi_values.size),
+        'mean': float(roi_values.mean()),
+        'std': float(roi_values.std()),
+        'percentiles': {p: float(value) for p, value in zip(PERCENTILES, percentiles)},
+        'probability_of_loss': float(np.mean(roi_values < 0)),
+        'histogram': {'counts': counts.tolist(), 'edges': edges.tolist()}
+    }
@@ -1,51 +1,255 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
+import roi
 
-def calculate_project_impact(inputs):
+logger = logging.getLogger(__name__)
+
+# Stylesheet of the light theme
+THEME_CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'theme.css')
+
+# Above this many projects the timeline shows weekly counts instead of single projects
+TIMELINE_MAX_POINTS = 5000
+# Marker diameter, in pixels, of the largest weekly count
+TIMELINE_MAX_MARKER_SIZE = 40
+
+# Serialized figures kept in memory, shared by all sessions, and optionally on disk
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+FIGURE_CACHE_DIR = os.environ.get('ROI_FIGURE_CACHE_DIR')
+FIGURE_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024
+# Part of FIGURE_CACHE_DISK_MAX_BYTES left after trimming the directory, so the next trim
+# is many figures away
+FIGURE_CACHE_DISK_TRIM_RATIO = 0.75
+# Part of every cache key, with the Plotly version and the chart function's source. Bump it
+# when figures change without a change to that source, e.g. in a helper or the theme.
+FIGURE_CACHE_VERSION = 1
+
+class _FigureCache:
     """
-    Calculate project impact based on various inputs
-    This is a simplified version - you can expand the calculation logic
+    Thread-safe LRU cache of figure JSON, bounded by the total size of the JSON.
+    With a directory, figures are also written there and survive restarts. The directory
+    size is estimated from the files written since it was last listed; once the estimate
+    exceeds disk_max_bytes, the least recently used files are removed.
     """
-    total_impact = 0
     
-    # Example calculation (modify based on your specific requirements)
-    if 'expected_revenue' in inputs:
-        total_impact += inputs['expected_revenue'] * 0.3
+    def __init__(self, max_bytes, directory=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.size = 0
+        self.disk_size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                self._trim_directory()
+            except OSError as e:
+                logger.warning("Error listing figure cache directory: %s", e)
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
     
-    if 'cost_savings' in inputs:
-        total_impact += inputs['cost_savings'] * 0.4
+    def get(self, key):
+        """Return the figure JSON stored for key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        
+        value = None
+        if self.directory:
+            try:
+                with open(self._path(key)) as f:
+                    value = f.read()
+                # The modification time orders the files for eviction
+                os.utime(self._path(key))
+            except OSError:
+                value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        if value is not None:
+            self._remember(key, value)
+        return value
     
-    if 'efficiency_improvement' in inputs:
-        total_impact += inputs['efficiency_improvement'] * 0.3
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.directory:
+            try:
+                # Write to a temporary file first so readers never see half a figure
+                path = self._path(key)
+                temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporary, 'w') as f:
+                    f.write(value)
+                os.replace(temporary, path)
+                with self._lock:
+                    # Replaced files are counted twice; the next listing corrects that
+                    self.disk_size += len(value)
+                    trim = self.disk_size > self.disk_max_bytes
+                if trim:
+                    self._trim_directory()
+            except OSError as e:
+                logger.warning("Error writing figure cache file: %s", e)
     
-    return total_impact
+    def _remember(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def _trim_directory(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total > self.disk_max_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.disk_max_bytes * FIGURE_CACHE_DISK_TRIM_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        with self._lock:
+            self.disk_size = total
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self.size}
+
+_figure_cache = _FigureCache(FIGURE_CACHE_MAX_BYTES, FIGURE_CACHE_DIR, FIGURE_CACHE_DISK_MAX_BYTES)
+
+def _encode_chart_argument(value):
+    """JSON form of the chart arguments json cannot encode by itself, for the cache key"""
+    if isinstance(value, np.ndarray):
+        return {'array': value.dtype.str, 'shape': value.shape,
+                'sha256': hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, roi.FormulaSet):
+        return {'formulas': value.version}
+    raise TypeError(f"Cannot hash chart argument of type {type(value).__name__}")
+
+def _figure_key(name, arguments):
+    """
+    Hash of a chart function and its {parameter: argument} dictionary. The arguments are
+    encoded as JSON with sorted keys, which is stable across processes and much faster
+    than walking them.
+    """
+    encoded = json.dumps([name, arguments], sort_keys=True, default=_encode_chart_argument)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+def _cached_figure(func):
+    """
+    Serve a chart function from the figure cache, keyed on a hash of the chart function
+    and its arguments. Every call gets its own Figure, rebuilt from the stored JSON.
+    Arguments are bound to the function's parameters with their defaults, so f(x) and
+    f(x, y=default) share an entry. Figures built by an older version of the function,
+    of Plotly or of FIGURE_CACHE_VERSION are never served.
+    """
+    signature = inspect.signature(func)
+    try:
+        source = inspect.getsource(func)
+    except OSError:
+        source = func.__code__.co_code.hex()
+    name = [func.__qualname__, FIGURE_CACHE_VERSION, plotly.__version__,
+            hashlib.sha256(source.encode()).hexdigest()]
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = _figure_key(name, bound.arguments)
+        except (TypeError, ValueError) as e:
+            logger.debug("Not caching %s: %s", func.__name__, e)
+            return func(*args, **kwargs)
+        
+        figure_json = _figure_cache.get(key)
+        if figure_json is None:
+            fig = func(*args, **kwargs)
+            _figure_cache.put(key, fig.to_json())
+            return fig
+        # The JSON came from a validated figure, so validating it again is skipped
+        return go.Figure(json.loads(figure_json), _validate=False)
+    return wrapper
+
+def figure_cache_stats():
+    """Return hit/miss counters and the size of the figure cache"""
+    return _figure_cache.stats()
+
+def clear_figure_cache():
+    """Empty the in-memory figure cache; files on disk are kept"""
+    _figure_cache.clear()
 
-def create_impact_visualization(project_data):
+def calculate_project_impact(inputs, formulas=None):
     """
-    Create visualizations for project impact analysis
+    Calculate project impact as the total benefits of the ROI model
+    (formulas is a roi.FormulaSet, the standard formulas by default)
     """
-    # Create a sample visualization
+    return roi.compute_roi(inputs, formulas=formulas)['total_benefits']
+
+@_cached_figure
+def create_impact_visualization(project_data, formulas=None):
+    """
+    Create visualizations for project impact analysis, broken down into the benefit
+    components of the ROI model
+    """
+    values = roi.RoiGraph(project_data, formulas=formulas).values
     fig = go.Figure()
     
     # Add impact components
     fig.add_trace(go.Bar(
         name='Revenue Impact',
         x=['Revenue'],
-        y=[project_data.get('expected_revenue', 0) * 0.3]
+        y=[values['expected_revenue']]
     ))
     
     fig.add_trace(go.Bar(
-        name='Cost Savings',
-        x=['Cost Savings'],
-        y=[project_data.get('cost_savings', 0) * 0.4]
+        name='Time Savings',
+        x=['Time Savings'],
+        y=[values['time_savings']]
     ))
     
     fig.add_trace(go.Bar(
         name='Efficiency Impact',
         x=['Efficiency'],
-        y=[project_data.get('efficiency_improvement', 0) * 0.3]
+        y=[values['efficiency_value']]
     ))
     
     fig.update_layout(
@@ -56,26 +260,199 @@ def create_impact_visualization(project_data):
     
     return fig
 
-def create_project_timeline(projects):
+def bucket_project_timeline(df):
+    """
+    Count the projects of a timeline DataFrame per week (starting on Monday),
+    project type and status, in the format of database.TIMELINE_WEEK_COLUMNS
+    """
+    week = df['created_at'].dt.to_period('W-SUN').dt.start_time.rename('week')
+    return df.groupby([week, 'project_type', 'status']).size().reset_index(name='count')
+
+@_cached_figure
+def create_project_timeline(projects, max_points=TIMELINE_MAX_POINTS):
+    """
+    Create a timeline visualization of projects.
+    projects is a column dict from database.get_project_timeline or a list of rows in the
+    get_all_projects format. Above max_points projects, weekly counts per project type
+    and status are drawn instead of single projects, with the marker size showing the
+    count. WebGL traces keep large timelines fast to render.
+    """
+    if isinstance(projects, dict):
+        df = pd.DataFrame(projects)
+    else:
+        df = pd.DataFrame(projects, columns=[
+            'id', 'title', 'description', 'project_type', 'status',
+            'customer_id', 'pm_estimate', 'it_director_estimate', 'created_at', 'customer_name'
+        ])
+    
+    if 'week' in df:
+        df['week'] = pd.to_datetime(df['week'])
+    else:
+        df['created_at'] = pd.to_datetime(df['created_at'])
+        if len(df) > max_points:
+            df = bucket_project_timeline(df)
+    weekly = 'week' in df
+    
+    fig = go.Figure()
+    if weekly:
+        sizeref = 2.0 * max(df['count'].max(), 1) / TIMELINE_MAX_MARKER_SIZE ** 2
+    colors = px.colors.qualitative.Plotly
+    for i, (status, group) in enumerate(df.groupby('status', sort=False)):
+        marker = {'color': colors[i % len(colors)]}
+        if weekly:
+            marker.update(size=group['count'], sizemode='area', sizeref=sizeref, sizemin=3)
+            hover = dict(customdata=group['count'],
+                         hovertemplate="Week of %{x|%Y-%m-%d}<br>%{y}<br>%{customdata} projects")
+        else:
+            hover = dict(customdata=group[['title', 'customer_name']],
+                         hovertemplate="%{customdata[0]}<br>%{customdata[1]}<br>%{x}")
+        fig.add_trace(go.Scattergl(
+            x=group['week' if weekly else 'created_at'],
+            y=group['project_type'],
+            mode='markers',
+            name=status,
+            marker=marker,
+            **hover
+        ))
+    
+    fig.update_layout(
+        title='Project Timeline (projects per week)' if weekly else 'Project Timeline',
+        xaxis_title='Week' if weekly else 'Created',
+        yaxis_title='Project Type',
+        legend_title='Status'
+    )
+    
+    return fig
+
+@_cached_figure
+def create_roi_distribution_chart(simulation_result):
+    """
+    Create a histogram of simulated ROI outcomes
+    """
+    histogram = simulation_result['histogram']
+    edges = histogram['edges']
+    centers = [(low + high) / 2 for low, high in zip(edges[:-1], edges[1:])]
+    colors = ['#d62728' if center < 0 else '#2ca02c' for center in centers]
+    
+    fig = go.Figure(go.Bar(
+        x=centers,
+        y=histogram['counts'],
+        width=edges[1] - edges[0],
+        marker_color=colors
+    ))
+    
+    for percentile in (5, 50, 95):
+        fig.add_vline(
+            x=simulation_result['percentiles'][percentile],
+            line_dash='dash',
+            annotation_text=f"P{percentile}"
+        )
+    
+    fig.update_layout(
+        title='Simulated ROI Distribution',
+        xaxis_title='ROI (%)',
+        yaxis_title='Scenarios',
+        bargap=0
+    )
+    
+    return fig
+
+@_cached_figure
+def create_tornado_chart(tornado_result, value_label='ROI (%)'):
+    """
+    Create a tornado chart of how far each input moves the result
+    """
+    rows = tornado_result['rows'][::-1]  # largest swing at the top
+    base = tornado_result['base']
+    labels = [row['label'] for row in rows]
+    
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        name='Input decreased',
+        y=labels,
+        x=[row['low'] - base for row in rows],
+        base=base,
+        orientation='h',
+        marker_color='#d62728'
+    ))
+    fig.add_trace(go.Bar(
+        name='Input increased',
+        y=labels,
+        x=[row['high'] - base for row in rows],
+        base=base,
+        orientation='h',
+        marker_color='#2ca02c'
+    ))
+    fig.add_vline(x=base, line_dash='dash', annotation_text='Base')
+    
+    fig.update_layout(
+        title='Sensitivity Analysis',
+        barmode='overlay',
+        xaxis_title=value_label
+    )
+    
+    return fig
+
+@_cached_figure
+def create_sensitivity_heatmap(grid_result, x_label, y_label, value_label='ROI (%)'):
     """
-    Create a timeline visualization of projects
+    Create a heatmap of a two-way sensitivity grid
     """
-    df = pd.DataFrame(projects, columns=[
-        'id', 'title', 'description', 'project_type', 'status',
-        'customer_id', 'pm_estimate', 'it_director_estimate', 'created_at', 'customer_name'
-    ])
+    fig = go.Figure(go.Heatmap(
+        x=[f"{(factor - 1) * 100:+.0f}%" for factor in grid_result['x_factors']],
+        y=[f"{(factor - 1) * 100:+.0f}%" for factor in grid_result['y_factors']],
+        z=grid_result['values'],
+        colorscale='RdYlGn',
+        colorbar={'title': value_label}
+    ))
     
-    df['created_at'] = pd.to_datetime(df['created_at'])
+    fig.update_layout(
+        title=f'{value_label} by {x_label} and {y_label}',
+        xaxis_title=f'{x_label} change',
+        yaxis_title=f'{y_label} change'
+    )
     
-    fig = px.scatter(df,
-                    x='created_at',
-                    y='project_type',
-                    color='status',
-                    hover_data=['title', 'customer_name'],
-                    title='Project Timeline')
+    return fig
+
+@_cached_figure
+def create_cumulative_cash_flow_chart(cash_flows, baseline_cash_flows=None):
+    """
+    Create a line chart of cumulative monthly cash flows, optionally against a baseline
+    """
+    fig = go.Figure()
+    if baseline_cash_flows is not None:
+        fig.add_trace(go.Scatter(
+            name='Current estimate',
+            x=list(range(len(baseline_cash_flows))),
+            y=pd.Series(baseline_cash_flows, dtype=float).cumsum(),
+            mode='lines',
+            line={'dash': 'dash', 'color': '#7f7f7f'}
+        ))
+    fig.add_trace(go.Scatter(
+        name='Scenario',
+        x=list(range(len(cash_flows))),
+        y=pd.Series(cash_flows, dtype=float).cumsum(),
+        mode='lines',
+        line={'color': '#1f77b4'}
+    ))
+    fig.add_hline(y=0, line_color='#d62728', line_width=1)
+    
+    fig.update_layout(
+        title='Cumulative Cash Flow',
+        xaxis_title='Month',
+        yaxis_title='Cumulative Cash Flow ($)'
+    )
     
     return fig
 
+@functools.cache
+def theme_css():
+    """
+    The theme stylesheet as a <style> block, read from disk once per process
+    """
+    with open(THEME_CSS_PATH) as f:
+        return f"<style>\n{f.read()}</style>"
+
 def format_currency(value):
     """
     Format number as currency
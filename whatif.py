@@ -0,0 +1,54 @@
+import functools
+import cashflow
+import roi
+
+# Scenarios whose cash flows are remembered; slider positions are revisited often while exploring
+CACHE_SIZE = 512
+
+def scenario_key(inputs, rates=None):
+    """
+    Normalized, hashable form of the inputs and rates a what-if result depends on:
+    the numeric inputs, the positive role hours in role order and the rates of those
+    roles. Inputs that cannot change the result (comments, zero hours) are left out.
+    """
+    if rates is None:
+        rates = roi.STANDARD_RATES
+    numbers = tuple(float(inputs.get(key, default)) for key, default in roi.NUMERIC_INPUT_DEFAULTS.items())
+    role_hours = tuple(sorted((role, float(hours)) for role, hours in (inputs.get('role_hours') or {}).items()
+                              if float(hours) > 0))
+    used_rates = tuple(float(rates.get(role, roi.DEFAULT_RATE)) for role, _ in role_hours)
+    return numbers, role_hours, used_rates
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _cash_flow(key, formulas):
+    numbers, role_hours, used_rates = key
+    inputs = dict(zip(roi.NUMERIC_INPUT_DEFAULTS, numbers), role_hours=dict(role_hours))
+    rates = {role: rate for (role, _), rate in zip(role_hours, used_rates)}
+    return cashflow.project_cash_flow(inputs, rates=rates, formulas=formulas)
+
+def what_if(inputs, rates=None, formulas=None, graph=None):
+    """
+    ROI, NPV, IRR, payback month and monthly cash flows of a hypothetical version of a
+    project. A pure function: it never touches the database.
+    graph is a roi.RoiGraph of the same formulas kept between calls, e.g. while a slider
+    moves; the scenario is applied to it with update(), so only the formulas downstream
+    of the inputs that changed since the previous scenario are calculated again.
+    Cash flows are memoized in a bounded LRU cache keyed on scenario_key and the formula set.
+    """
+    formulas = formulas or roi.DEFAULT_FORMULAS
+    if rates is None:
+        rates = roi.STANDARD_RATES
+    if graph is None:
+        graph = roi.RoiGraph(inputs, rates, formulas)
+    else:
+        graph.update(inputs, rates)
+    
+    result = graph.result()
+    metrics = _cash_flow(scenario_key(inputs, rates), formulas)
+    # Callers get their own list so the cached one cannot be changed
+    result.update(metrics, cash_flows=list(metrics['cash_flows']))
+    return result
+
+def cache_info():
+    """Hits, misses and size of the cash flow cache"""
+    return _cash_flow.cache_info()
@@ -0,0 +1,222 @@
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone
+import numpy as np
+import database as db
+import formulas
+import portfolio
+import rates
+import roi
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+WORKER_THREADS = 4
+POLL_INTERVAL_SECONDS = 2
+# Jobs still marked running after this long belong to a worker that died
+STALE_JOB_MINUTES = 10
+# Wait after a failed poll, doubled on each failure in a row up to the maximum
+ERROR_BACKOFF_SECONDS = 1
+MAX_ERROR_BACKOFF_SECONDS = 60
+
+_background_worker = None
+_background_thread = None
+_background_lock = threading.Lock()
+
+def refresh_project_roi(project_id, force=False):
+    """
+    Return the stored ROI of a project, recalculating and storing it first
+    if the project's inputs changed since it was saved, or always with force.
+    """
+    inputs = db.get_project_inputs(project_id)
+    project = db.get_project(project_id)
+    project_type = project[3] if project else None
+    project_rates = rates.rate_card().rates_for(project_type)
+    project_formulas = formulas.formula_registry().for_type(project_type)
+    input_hash = roi.inputs_hash(inputs, project_rates, project_formulas)
+    
+    stored = db.get_project_roi(project_id)
+    if stored and stored.pop('input_hash') == input_hash and not force:
+        return stored
+    
+    roi_data = roi.compute_roi(inputs, project_rates, project_formulas)
+    db.save_project_roi(project_id, input_hash, roi_data)
+    logger.debug("Recalculated ROI for project %s: %.1f%%", project_id, roi_data['roi'])
+    return roi_data
+
+def recost_all_projects():
+    """
+    Recalculate and store the ROI of every project in one vectorized batch, instead of one
+    job per project. The worker runs it when a re-cost is requested, e.g. after a rate or
+    formula change. Returns the number of projects stored.
+    """
+    card = rates.rate_card()
+    registry = formulas.formula_registry()
+    projects, columns, roles = portfolio.load_portfolio_columns()
+    results = roi.calculate_roi_batch(columns, roles, card.rate_matrix(roles, projects['project_type']),
+                                      registry.for_types(projects['project_type']))
+    
+    project_ids = projects['id'].tolist()
+    inputs_by_id = db.get_project_inputs_many(project_ids)
+    type_rates = {project_type: card.rates_for(project_type) for project_type in set(projects['project_type'])}
+    hashes = [roi.inputs_hash(inputs_by_id[project_id], type_rates[project_type], registry.for_type(project_type))
+              for project_id, project_type in zip(project_ids, projects['project_type'])]
+    
+    # Same column order as the project_roi table
+    values = np.column_stack([
+        results['total_benefits'], results['total_costs'], results['roi'],
+        columns['expected_revenue'], columns['time_savings'], columns['efficiency_improvement'],
+        results['labor_cost'], results['infrastructure_cost'], results['software_cost'], results['training_cost']
+    ]).tolist()
+    rows = [(project_id, input_hash, *row) for project_id, input_hash, row in zip(project_ids, hashes, values)]
+    db.save_project_roi_many(rows)
+    logger.info("Recosted %d projects", len(rows))
+    return len(rows)
+
+class RoiWorker:
+    """Recalculates the ROI of the projects queued in the roi_jobs table"""
+    
+    def __init__(self, threads=WORKER_THREADS, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.processed = 0
+        self.failed = 0
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='roi-worker')
+        self._stop = threading.Event()
+        self._rates_effective_from = None
+    
+    def _run_job(self, job):
+        project_id, generation = job
+        try:
+            # Stored even when unchanged, so computed_at shows the result is current
+            refresh_project_roi(project_id, force=True)
+            db.finish_roi_job(project_id, generation)
+            return True
+        except Exception as e:
+            logger.error("Error recalculating ROI for project %s: %s", project_id, e)
+            try:
+                db.finish_roi_job(project_id, generation, error=str(e))
+            except Exception as finish_error:
+                # The job stays 'running' and is requeued once it is stale
+                logger.error("Error marking ROI job of project %s as failed: %s", project_id, finish_error)
+            return False
+    
+    def queue_rate_changes(self):
+        """
+        Request a re-cost if projects were calculated before the latest rate change in
+        effect, once per change. This recalculates them when a future-dated rate takes
+        effect, and after a restart catches up on rates that took effect while no worker
+        was running.
+        """
+        effective_from = rates.rate_card().effective_from
+        if effective_from != self._rates_effective_from:
+            # Rates take effect at local midnight; computed_at is in UTC
+            start = datetime.combine(datetime.fromisoformat(effective_from).date(), time()).astimezone(timezone.utc)
+            if db.request_recost_if_computed_before(start.strftime('%Y-%m-%d %H:%M:%S')):
+                logger.info("Requested a re-cost for the rates in effect from %s", effective_from)
+            self._rates_effective_from = effective_from
+    
+    def run_recost(self):
+        """Run the requested bulk re-cost, if any. Returns the number of projects stored."""
+        generation = db.claim_recost(STALE_JOB_MINUTES)
+        if generation is None:
+            return 0
+        try:
+            stored = recost_all_projects()
+        except Exception as e:
+            logger.error("Error recosting projects: %s", e)
+            db.finish_recost(generation, error=str(e))
+            return 0
+        db.finish_recost(generation)
+        return stored
+    
+    def run_once(self):
+        """Process one batch of queued jobs. Returns the number of jobs processed."""
+        jobs = db.claim_roi_jobs(self.batch_size)
+        if not jobs:
+            return 0
+        
+        results = list(self._pool.map(self._run_job, jobs))
+        self.processed += results.count(True)
+        self.failed += results.count(False)
+        
+        progress = db.get_roi_job_progress()
+        logger.info("Recalculated ROI for %d projects (%d done, %d failed, %d pending)",
+                    len(jobs), self.processed, self.failed, progress.get('pending', 0))
+        return len(jobs)
+    
+    def run(self, poll_interval=POLL_INTERVAL_SECONDS, until_empty=False):
+        """Process jobs until stopped, or until the queue is empty if until_empty is set"""
+        stale_requeued = False
+        backoff = 0
+        try:
+            while not self._stop.is_set():
+                # Errors such as a locked database must not end the worker thread
+                try:
+                    if not stale_requeued:
+                        requeued = db.requeue_stale_roi_jobs(STALE_JOB_MINUTES)
+                        if requeued:
+                            logger.info("Requeued %d stale ROI jobs", requeued)
+                        stale_requeued = True
+                    self.queue_rate_changes()
+                    processed = self.run_recost() + self.run_once()
+                    backoff = 0
+                except Exception as e:
+                    backoff = min(max(backoff * 2, ERROR_BACKOFF_SECONDS), MAX_ERROR_BACKOFF_SECONDS)
+                    logger.error("ROI worker error, retrying in %s seconds: %s", backoff, e)
+                    self._stop.wait(backoff)
+                    continue
+                
+                if processed == 0:
+                    if until_empty:
+                        break
+                    self._stop.wait(poll_interval)
+        finally:
+            self._pool.shutdown(wait=True)
+    
+    def stop(self):
+        self._stop.set()
+
+def start_background_worker():
+    """
+    Start one ROI worker thread per process; later calls return the running worker,
+    or start a new one if its thread has ended
+    """
+    global _background_worker, _background_thread
+    with _background_lock:
+        if _background_thread is None or not _background_thread.is_alive():
+            if _background_thread is not None:
+                logger.warning("ROI worker thread ended, starting a new one")
+            _background_worker = RoiWorker()
+            _background_thread = threading.Thread(target=_background_worker.run, name='roi-worker', daemon=True)
+            _background_thread.start()
+        return _background_worker
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalculate queued project ROI results")
+    parser.add_argument('--all', action='store_true', help="queue every project before starting")
+    parser.add_argument('--once', action='store_true', help="exit once the queue is empty")
+    parser.add_argument('--threads', type=int, default=WORKER_THREADS, help="number of worker threads")
+    parser.add_argument('--recost', action='store_true', help="recalculate every project in one batch and exit")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    db.init_db()
+    
+    if args.recost:
+        recost_all_projects()
+        return
+    
+    if args.all:
+        logger.info("Queued %d projects", db.enqueue_all_roi_jobs())
+    
+    worker = RoiWorker(threads=args.threads)
+    try:
+        worker.run(until_empty=args.once)
+    except KeyboardInterrupt:
+        worker.stop()
+    logger.info("Finished: %d recalculated, %d failed", worker.processed, worker.failed)
+
+if __name__ == "__main__":
+    main()